@@ -20,16 +20,62 @@ Traditional Linux Memory Management Mock
 """
 
 import threading
-from typing import List, Dict, Optional, Tuple
-from dataclasses import dataclass
-from enum import Enum
+from bisect import bisect_right, insort
+from operator import attrgetter
+from typing import Dict
+
+try:
+    from sortedcontainers import SortedKeyList
+except ImportError:
+    SortedKeyList = None
+
+from cortenmm.core import PAGE_SIZE, PAGE_MASK
+
+
+class _BisectVMAList(list):
+    """
+    sortedcontainers 不可用时的后备实现
+
+    普通 list + bisect.insort 维护按 start 排序：
+    查找仍是 O(log n)，插入/删除是 O(n) 的搬移（但没有每次全量 sort），
+    接口与 LinuxMock 用到的 SortedKeyList 子集一致
+    """
+
+    _key = attrgetter('start')
+
+    def add(self, vma):
+        insort(self, vma, key=self._key)
+
+    def bisect_key_right(self, start):
+        return bisect_right(self, start, key=self._key)
+
+    def irange_key(self, lo, hi, inclusive=(True, False)):
+        # 只支持 LinuxMock 实际使用的 [lo, hi) 形式
+        for i in range(self.bisect_key_right(lo - 1), len(self)):
+            if self[i].start >= hi:
+                break
+            yield self[i]
+
+
+def _make_vma_list():
+    """构造 VMA 有序容器，优先使用 sortedcontainers"""
+    if SortedKeyList is not None:
+        return SortedKeyList(key=lambda v: v.start)
+    return _BisectVMAList()
+
+
+# 分桶锁数量（2 的幂，便于用位运算取桶号）
+NUM_LOCK_BUCKETS = 16
+
+# 取桶号时丢弃的低位：每个线程的工作集相隔 0x10000000，
+# 右移 28 位后不同线程的地址落在不同的桶里
+LOCK_BUCKET_SHIFT = 28
 
 
 # ============================================================================
 # VMA：虚拟内存区域
 # ============================================================================
 
-@dataclass
 class VMA:
     """
     Virtual Memory Area - 传统 Linux 的核心数据结构
@@ -38,11 +84,18 @@ class VMA:
     1. 额外的内存开销（每个区域都需要一个 VMA 对象）
     2. 查找开销（需要在红黑树中搜索）
     3. 并发开销（需要全局锁保护）
+
+    用 __slots__ 固定属性布局：省掉每个实例的 __dict__，
+    mmap 风暴下大量 VMA 对象的分配和属性访问都更便宜
     """
-    start: int  # 起始地址
-    end: int    # 结束地址
-    prot: int   # 保护标志
-    flags: int  # 标志（匿名、文件映射等）
+
+    __slots__ = ('start', 'end', 'prot', 'flags')
+
+    def __init__(self, start: int, end: int, prot: int, flags: int):
+        self.start = start  # 起始地址
+        self.end = end      # 结束地址
+        self.prot = prot    # 保护标志
+        self.flags = flags  # 标志（匿名、文件映射等）
 
     def contains(self, vaddr: int) -> bool:
         """检查地址是否在此 VMA 中"""
@@ -56,20 +109,19 @@ class VMA:
 # 简化的页表（不需要像 CortenMM 那样复杂）
 # ============================================================================
 
-@dataclass
-class SimplePTE:
-    """简化的页表项"""
-    pfn: Optional[int] = None
-    present: bool = False
-    rw: bool = False
+# 页表项打包成单个 int，省去每页一个 Python 对象的开销：
+# bit 0: present, bit 1: rw, bit 2+: pfn
+PTE_PRESENT = 0x1
+PTE_RW = 0x2
+PTE_PFN_SHIFT = 2
 
-    def clear(self):
-        self.pfn = None
-        self.present = False
-        self.rw = False
 
-    def is_valid(self) -> bool:
-        return self.present and self.pfn is not None
+def pack_pte(pfn: int, rw: bool) -> int:
+    """把 (pfn, rw) 打包成一个 present 页表项"""
+    entry = (pfn << PTE_PFN_SHIFT) | PTE_PRESENT
+    if rw:
+        entry |= PTE_RW
+    return entry
 
 
 # ============================================================================
@@ -95,31 +147,76 @@ class LinuxMock:
     """
 
     def __init__(self):
-        # === 全局锁（这是性能瓶颈！）===
-        # 类似 Linux 的 mmap_sem（现在是 mmap_lock）
-        self.mmap_lock = threading.Lock()
-
-        # === VMA 列表（简化版，实际是红黑树）===
-        # 每次查找都需要线性搜索或树搜索
-        self.vmas: List[VMA] = []
+        # === 分桶锁（fanned-out lock）===
+        # 原先是单个全局 mmap_lock，所有操作都在它上面串行化；
+        # 现在按 (vaddr >> LOCK_BUCKET_SHIFT) & (N-1) 分成 N 个子锁：
+        # - 缺页异常只锁自己地址所在的桶
+        # - mmap/munmap/fork 等跨桶操作按序获取全部子锁
+        self.mmap_locks = [threading.Lock() for _ in range(NUM_LOCK_BUCKETS)]
+
+        # === VMA 有序容器（模拟红黑树）===
+        # 按 start 排序的有序列表，查找/插入/删除都是 O(log n)
+        # 避免了原先"线性扫描 + 每次插入后全量 sort"的 O(n log n) 开销
+        # （没有 sortedcontainers 时退化为 bisect.insort 维护的有序 list）
+        self.vmas = _make_vma_list()
 
         # === 页表（简化为字典）===
-        # vaddr -> PTE
-        self.page_table: Dict[int, SimplePTE] = {}
+        # vaddr -> 打包的页表项（int），见 pack_pte
+        # 相比每页一个 SimplePTE 对象，打包 int 省内存也省属性访问
+        self.page_table: Dict[int, int] = {}
 
         # === 物理页分配器 ===
         self.next_pfn = 0x1000
         self.pfn_lock = threading.Lock()
+        # 每线程的页框仓库（与 AddrSpace.allocate_pfn 同一套路）
+        self._pfn_tls = threading.local()
 
         # === COW 引用计数 ===
         self.cow_refcounts: Dict[int, int] = {}
 
+    # 每线程仓库一次补充的页框数
+    _PFN_REFILL = 32
+
     def allocate_pfn(self) -> int:
-        """分配物理页框号"""
+        """
+        分配物理页框号
+
+        page_fault_heavy 负载里每次缺页都要分配一页，逐页抢
+        pfn_lock 会让各桶的缺页处理在这把锁上重新串行化；
+        快路径改为从本线程仓库无锁弹出，空了才加锁批量预留
+        """
+        cache = getattr(self._pfn_tls, 'cache', None)
+        if cache:
+            return cache.pop()
+
         with self.pfn_lock:
             pfn = self.next_pfn
-            self.next_pfn += 1
-            return pfn
+            self.next_pfn += self._PFN_REFILL
+        # 第一个直接返回，其余留在本线程仓库
+        self._pfn_tls.cache = list(range(pfn + 1, pfn + self._PFN_REFILL))
+        return pfn
+
+    def _bucket_lock(self, vaddr: int) -> threading.Lock:
+        """返回 vaddr 所在分桶的子锁（读者/单地址路径）"""
+        return self.mmap_locks[(vaddr >> LOCK_BUCKET_SHIFT) & (NUM_LOCK_BUCKETS - 1)]
+
+    def _acquire_all(self):
+        """
+        按固定顺序获取全部分桶锁（跨桶的写者路径）
+
+        mmap/munmap 会修改跨桶共享的 VMA 容器，必须独占所有桶；
+        固定的获取顺序避免了与其他写者的死锁。
+
+        用普通方法 + try/finally 而不是 contextmanager 生成器，
+        省掉热路径上每次调用的生成器创建和 __enter__/__exit__ 分发
+        """
+        for lock in self.mmap_locks:
+            lock.acquire()
+
+    def _release_all(self):
+        """释放全部分桶锁（与 _acquire_all 配对）"""
+        for lock in reversed(self.mmap_locks):
+            lock.release()
 
     def do_mmap(self, vaddr: int, length: int, prot: int) -> int:
         """
@@ -129,22 +226,24 @@ class LinuxMock:
         - CortenMM: 只锁定相关的页表页，O(1) 操作
         - Linux: 获取全局锁，搜索 VMA 树，插入新 VMA，O(log n) 操作
         """
-        vaddr = vaddr & ~0xFFF
-        vaddr_end = (vaddr + length + 0xFFF) & ~0xFFF
-
-        # === 获取全局锁（瓶颈！）===
-        with self.mmap_lock:
-            # 检查是否与现有 VMA 重叠（简化版）
-            for vma in self.vmas:
-                if not (vaddr_end <= vma.start or vaddr >= vma.end):
-                    return -1  # 重叠
-
-            # 创建新的 VMA
-            new_vma = VMA(start=vaddr, end=vaddr_end, prot=prot, flags=0)
-            self.vmas.append(new_vma)
-
-            # 排序 VMA 列表（真实系统用红黑树维护顺序）
-            self.vmas.sort(key=lambda v: v.start)
+        vaddr = vaddr & PAGE_MASK
+        vaddr_end = (vaddr + length + PAGE_SIZE - 1) & PAGE_MASK
+
+        # === 写者路径：获取全部分桶锁 ===
+        self._acquire_all()
+        try:
+            # 检查是否与现有 VMA 重叠
+            # 有序容器下只需检查前驱和后继两个邻居，O(log n)
+            idx = self.vmas.bisect_key_right(vaddr)
+            if idx > 0 and self.vmas[idx - 1].end > vaddr:
+                return -1  # 与前驱重叠
+            if idx < len(self.vmas) and self.vmas[idx].start < vaddr_end:
+                return -1  # 与后继重叠
+
+            # 创建新的 VMA 并有序插入（真实系统用红黑树维护顺序）
+            self.vmas.add(VMA(start=vaddr, end=vaddr_end, prot=prot, flags=0))
+        finally:
+            self._release_all()
 
         return vaddr
 
@@ -157,23 +256,32 @@ class LinuxMock:
         2. 查找并删除 VMA
         3. 清理页表
         """
-        vaddr = vaddr & ~0xFFF
-        vaddr_end = (vaddr + length + 0xFFF) & ~0xFFF
-
-        # === 获取全局锁（瓶颈！）===
-        with self.mmap_lock:
-            # 查找并删除 VMA
-            self.vmas = [vma for vma in self.vmas
-                         if not (vma.start >= vaddr and vma.end <= vaddr_end)]
-
-            # 清理页表
-            current = vaddr
-            while current < vaddr_end:
-                if current in self.page_table:
-                    pte = self.page_table[current]
-                    pte.clear()
-                    del self.page_table[current]
-                current += 0x1000
+        vaddr = vaddr & PAGE_MASK
+        vaddr_end = (vaddr + length + PAGE_SIZE - 1) & PAGE_MASK
+
+        # === 写者路径：获取全部分桶锁 ===
+        self._acquire_all()
+        try:
+            # 查找并删除完全落在 [vaddr, vaddr_end) 内的 VMA
+            # irange_key 只遍历范围内的候选，不再全表扫描
+            victims = [vma for vma in
+                       self.vmas.irange_key(vaddr, vaddr_end, inclusive=(True, False))
+                       if vma.end <= vaddr_end]
+            for vma in victims:
+                self.vmas.remove(vma)
+
+            # 清理页表：批量处理整个范围
+            # 范围大而映射稀疏时，扫描已映射的 key 比逐页探测更快
+            num_pages = (vaddr_end - vaddr) >> 12
+            if num_pages > len(self.page_table):
+                for page in [p for p in self.page_table
+                             if vaddr <= p < vaddr_end]:
+                    del self.page_table[page]
+            else:
+                for page in range(vaddr, vaddr_end, PAGE_SIZE):
+                    self.page_table.pop(page, None)
+        finally:
+            self._release_all()
 
         return 0
 
@@ -185,62 +293,75 @@ class LinuxMock:
         - CortenMM: 只锁定相关页表页，其他线程可以并发处理不同地址
         - Linux: 获取全局锁，阻塞所有其他线程
         """
-        vaddr_page = vaddr & ~0xFFF
-
-        # === 获取全局锁（瓶颈！）===
-        with self.mmap_lock:
+        vaddr_page = vaddr & PAGE_MASK
+
+        # === 读者路径：只锁自己地址所在的桶 ===
+        # 不同桶的缺页异常可以并发处理。
+        # 这里内联取桶 + 直接 acquire/release，避免 with 语句
+        # 在最热的路径上反复做 __enter__/__exit__ 方法查找
+        lock = self.mmap_locks[(vaddr >> LOCK_BUCKET_SHIFT) & (NUM_LOCK_BUCKETS - 1)]
+        lock.acquire()
+        try:
             # === 第一步：查找 VMA（双重查找的第一步）===
+            # 有序容器下取 vaddr 的前驱并检查包含关系，O(log n)
             vma = None
-            for v in self.vmas:
-                if v.contains(vaddr):
-                    vma = v
-                    break
+            idx = self.vmas.bisect_key_right(vaddr)
+            if idx > 0 and self.vmas[idx - 1].contains(vaddr):
+                vma = self.vmas[idx - 1]
 
             if vma is None:
                 # 无效访问
                 return False
 
             # === 第二步：查找/创建 PTE（双重查找的第二步）===
-            if vaddr_page not in self.page_table:
-                # 分配物理页
+            entry = self.page_table.get(vaddr_page)
+            if entry is None:
+                # 分配物理页并写入打包的页表项
                 pfn = self.allocate_pfn()
-
-                # 创建 PTE
-                pte = SimplePTE(pfn=pfn, present=True, rw=(vma.prot & 0b010) != 0)
-                self.page_table[vaddr_page] = pte
+                self.page_table[vaddr_page] = pack_pte(pfn, rw=(vma.prot & 0b010) != 0)
 
                 return True
             else:
                 # PTE 已存在
-                pte = self.page_table[vaddr_page]
-
-                if is_write and not pte.rw:
+                if is_write and not (entry & PTE_RW):
                     # 可能是 COW
                     # （简化处理）
                     return False
 
                 return True
+        finally:
+            lock.release()
 
     def do_fork_cow(self, vaddr: int, length: int) -> bool:
         """fork 时的 COW 设置"""
-        vaddr = vaddr & ~0xFFF
-        vaddr_end = (vaddr + length + 0xFFF) & ~0xFFF
-
-        # === 获取全局锁（瓶颈！）===
-        with self.mmap_lock:
-            current = vaddr
-            while current < vaddr_end:
-                if current in self.page_table:
-                    pte = self.page_table[current]
-                    if pte.is_valid():
-                        # 设置为只读
-                        pte.rw = False
-
-                        # 增加引用计数
-                        pfn = pte.pfn
-                        self.cow_refcounts[pfn] = self.cow_refcounts.get(pfn, 1) + 1
-
-                current += 0x1000
+        vaddr = vaddr & PAGE_MASK
+        vaddr_end = (vaddr + length + PAGE_SIZE - 1) & PAGE_MASK
+
+        # === 写者路径：获取全部分桶锁 ===
+        self._acquire_all()
+        try:
+            # 批量处理整个范围，只访问实际存在的页表项
+            page_table = self.page_table
+            cow_refcounts = self.cow_refcounts
+
+            num_pages = (vaddr_end - vaddr) >> 12
+            if num_pages > len(page_table):
+                pages = [p for p in page_table if vaddr <= p < vaddr_end]
+            else:
+                pages = [p for p in range(vaddr, vaddr_end, PAGE_SIZE)
+                         if p in page_table]
+
+            for page in pages:
+                entry = page_table[page]
+                if entry & PTE_PRESENT:
+                    # 清掉 RW 位，设置为只读
+                    page_table[page] = entry & ~PTE_RW
+
+                    # 增加引用计数
+                    pfn = entry >> PTE_PFN_SHIFT
+                    cow_refcounts[pfn] = cow_refcounts.get(pfn, 1) + 1
+        finally:
+            self._release_all()
 
         return True
 
@@ -4,13 +4,9 @@ Performance Benchmark: CortenMM vs Traditional Linux
 这个模块实现了性能对比测试，展示 CortenMM 在多核并发场景下的优势
 """
 
-import sys
-import os
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-
-import threading
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Callable, Tuple
 
 from cortenmm.syscalls import CortenMMSystem
@@ -42,42 +38,48 @@ class Workload:
         # 每个线程有独立的地址空间
         thread_base = base_addr + (thread_id * 0x10000000)
 
+        # 在循环外解析一次系统类型，绑定具体的入口函数
+        if isinstance(system, CortenMMSystem):
+            do_mmap = system.do_syscall_mmap
+            do_munmap = system.do_syscall_munmap
+        else:
+            do_mmap = system.do_mmap
+            do_munmap = system.do_munmap
+        handle_fault = system.handle_page_fault
+
+        # 预生成本次需要的全部随机数，热循环里不再调用 random.randint
+        # （每次 randint 都有参数检查和多层函数调用的开销）
+        rng = random.Random()
+        op_types = rng.choices((0, 1, 2), k=num_ops)
+        lengths = rng.choices(range(0x1000, 0xB000, 0x1000), k=num_ops)
+        fractions = [rng.random() for _ in range(num_ops)]
+
+        # 三种操作封装成闭包，循环里用查表分发代替 if/elif 链
+        # 返回值是本次完成的操作数（munmap 在 i == 0 时跳过）
+        def op_mmap(i):
+            vaddr = thread_base + (i * 0x1000)
+            do_mmap(vaddr, lengths[i], prot=0b111)
+            return 1
+
+        def op_fault(i):
+            # fractions[i] 均匀缩放到 [0, i+1]，等价于 randint(0, i + 1)
+            vaddr = thread_base + (int(fractions[i] * (i + 2)) * 0x1000)
+            handle_fault(vaddr, is_write=True)
+            return 1
+
+        def op_munmap(i):
+            if i == 0:
+                return 0
+            vaddr = thread_base + (int(fractions[i] * (i + 1)) * 0x1000)
+            do_munmap(vaddr, 0x1000)
+            return 1
+
+        dispatch = (op_mmap, op_fault, op_munmap)
+
+        # enumerate 直接产出 (i, op_type)，循环体里不再做下标访问
         ops_completed = 0
-
-        for i in range(num_ops):
-            op_type = random.randint(0, 2)
-
-            if op_type == 0:
-                # mmap 操作
-                vaddr = thread_base + (i * 0x1000)
-                length = 0x1000 * random.randint(1, 10)
-
-                if isinstance(system, CortenMMSystem):
-                    system.do_syscall_mmap(vaddr, length, prot=0b111)
-                else:
-                    system.do_mmap(vaddr, length, prot=0b111)
-
-                ops_completed += 1
-
-            elif op_type == 1:
-                # page fault 操作
-                vaddr = thread_base + (random.randint(0, i + 1) * 0x1000)
-
-                system.handle_page_fault(vaddr, is_write=True)
-                ops_completed += 1
-
-            else:
-                # munmap 操作
-                if i > 0:
-                    vaddr = thread_base + (random.randint(0, i) * 0x1000)
-                    length = 0x1000
-
-                    if isinstance(system, CortenMMSystem):
-                        system.do_syscall_munmap(vaddr, length)
-                    else:
-                        system.do_munmap(vaddr, length)
-
-                    ops_completed += 1
+        for i, op_type in enumerate(op_types):
+            ops_completed += dispatch[op_type](i)
 
         return ops_completed
 
@@ -91,20 +93,22 @@ class Workload:
         """
         thread_base = base_addr + (thread_id * 0x10000000)
 
+        # 系统类型只判定一次，循环里不再做 isinstance
+        do_mmap = (system.do_syscall_mmap if isinstance(system, CortenMMSystem)
+                   else system.do_mmap)
+
         # 先 mmap 一大块内存
-        if isinstance(system, CortenMMSystem):
-            system.do_syscall_mmap(thread_base, num_ops * 0x1000, prot=0b111)
-        else:
-            system.do_mmap(thread_base, num_ops * 0x1000, prot=0b111)
+        do_mmap(thread_base, num_ops * 0x1000, prot=0b111)
 
         ops_completed = 0
 
-        # 随机访问，触发缺页异常
-        for i in range(num_ops):
-            offset = random.randint(0, num_ops - 1) * 0x1000
-            vaddr = thread_base + offset
+        # 预生成随机访问序列，热循环里只剩缺页异常本身
+        rng = random.Random()
+        offsets = rng.choices(range(0, num_ops * 0x1000, 0x1000), k=num_ops)
 
-            system.handle_page_fault(vaddr, is_write=True)
+        handle_fault = system.handle_page_fault
+        for offset in offsets:
+            handle_fault(thread_base + offset, is_write=True)
             ops_completed += 1
 
         return ops_completed
@@ -119,24 +123,24 @@ class Workload:
         """
         thread_base = base_addr + (thread_id * 0x10000000)
 
+        # 系统类型只判定一次，两个循环里都不再做 isinstance
+        if isinstance(system, CortenMMSystem):
+            do_mmap = system.do_syscall_mmap
+            do_munmap = system.do_syscall_munmap
+        else:
+            do_mmap = system.do_mmap
+            do_munmap = system.do_munmap
+
         # 先分配大量小块内存
         for i in range(num_ops):
             vaddr = thread_base + (i * 0x2000)  # 留间隔
-            if isinstance(system, CortenMMSystem):
-                system.do_syscall_mmap(vaddr, 0x1000, prot=0b111)
-            else:
-                system.do_mmap(vaddr, 0x1000, prot=0b111)
+            do_mmap(vaddr, 0x1000, prot=0b111)
 
         ops_completed = 0
 
         # 并发 munmap
         for i in range(num_ops):
-            vaddr = thread_base + (i * 0x2000)
-            if isinstance(system, CortenMMSystem):
-                system.do_syscall_munmap(vaddr, 0x1000)
-            else:
-                system.do_munmap(vaddr, 0x1000)
-
+            do_munmap(thread_base + (i * 0x2000), 0x1000)
             ops_completed += 1
 
         return ops_completed
@@ -151,8 +155,24 @@ class PerformanceBenchmark:
     性能测试框架
     """
 
-    @staticmethod
+    # 常驻线程池：线程创建/销毁的开销很可观（每个约几十微秒加上
+    # 栈分配），不应计入被测系统的吞吐量。线程池按需扩容并跨测试复用
+    _executor: ThreadPoolExecutor = None
+    _executor_size: int = 0
+
+    @classmethod
+    def _get_executor(cls, num_threads: int) -> ThreadPoolExecutor:
+        """获取容量不小于 num_threads 的常驻线程池"""
+        if cls._executor is None or cls._executor_size < num_threads:
+            if cls._executor is not None:
+                cls._executor.shutdown(wait=True)
+            cls._executor = ThreadPoolExecutor(max_workers=num_threads)
+            cls._executor_size = num_threads
+        return cls._executor
+
+    @classmethod
     def run_concurrent_benchmark(
+        cls,
         system_factory: Callable,
         workload_func: Callable,
         num_threads: int,
@@ -173,25 +193,17 @@ class PerformanceBenchmark:
         # 创建系统实例
         system = system_factory()
 
-        # 创建线程
-        threads = []
-        results = [0] * num_threads
+        executor = cls._get_executor(num_threads)
 
         def worker(tid):
-            results[tid] = workload_func(system, tid, ops_per_thread)
+            return workload_func(system, tid, ops_per_thread)
 
         # 启动计时
         start_time = time.time()
 
-        # 启动所有线程
-        for i in range(num_threads):
-            t = threading.Thread(target=worker, args=(i,))
-            threads.append(t)
-            t.start()
-
-        # 等待所有线程完成
-        for t in threads:
-            t.join()
+        # 提交所有工作线程并等待完成
+        futures = [executor.submit(worker, i) for i in range(num_threads)]
+        results = [f.result() for f in futures]
 
         # 结束计时
         elapsed = time.time() - start_time
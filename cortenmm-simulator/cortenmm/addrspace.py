@@ -16,15 +16,53 @@ CortenMM Address Space Management with Advanced Locking Protocol
 import contextlib
 import threading
 import time
-from typing import List, Optional, Set
 from collections import deque
+from operator import attrgetter
+from typing import List, Optional, Set
 
 from .core import (
-    Status, PTE, PTEMetadata, PageDescriptor, PageTablePage,
-    PTES_PER_PAGE, parse_vaddr, make_vaddr
+    Status, PTE, PTE_HUGE, PTEMetadata, PageDescriptor, PageTablePage,
+    PTES_PER_PAGE, PAGE_SIZE, PAGE_MASK, HUGE_PAGE_SIZE,
+    parse_vaddr, make_vaddr
 )
 from .cursor import RCursor
 
+# 批量加锁的排序键：描述符的全局序号
+_descriptor_ord = attrgetter('descriptor.ord')
+
+# 退役页表页缓存池：RCU 整代回收时把度过宽限期的页重置后放回，
+# 新建页表页优先从池里取，mmap/munmap 高频交替时不再反复分配
+# 整页 PTE 数组和三个 SoA 元数据数组
+_page_pool: deque = deque(maxlen=1024)
+
+
+def _new_page(level: int) -> PageTablePage:
+    """分配一个页表页，优先复用缓存池中的退役页"""
+    if _page_pool:
+        try:
+            page = _page_pool.pop()
+        except IndexError:
+            # 并发取空了池子，退回常规分配
+            return PageTablePage(level=level)
+        page.level = level
+        return page
+    return PageTablePage(level=level)
+
+
+class _ReaderState:
+    """
+    单个线程的 RCU 读侧状态
+
+    nesting > 0 表示该线程正处于读临界区内。
+    每个线程只在首次进入时注册一次，之后读侧进出
+    只是对自己状态对象的一次整数增减，不碰任何锁
+    """
+
+    __slots__ = ('nesting',)
+
+    def __init__(self):
+        self.nesting = 0
+
 
 # ============================================================================
 # RCU 回收队列
@@ -44,9 +82,41 @@ class RCUReclaimer:
     """
 
     def __init__(self):
-        self.queue = deque()
+        # 基于"代"（epoch）的两批回收：
+        # - current_batch: 本代标记的 stale 页
+        # - prev_batch: 上一代的 stale 页，本代结束时整批释放
+        # 每页不再单独记录时间戳，整代只维护一个起始时间，
+        # defer_free / try_reclaim 都退化为 O(1) 的指针操作
+        self.current_batch: list = []
+        self.prev_batch: list = []
+        self.epoch_start = time.perf_counter_ns()
         self.lock = threading.Lock()
 
+        # 读者登记表：每个线程一个 _ReaderState，首次进入时注册。
+        # 回收前检查所有登记线程都不在读临界区内（静止状态），
+        # 让 is_stale 标记真正兑现"读者还在就不释放"的承诺
+        self._tls = threading.local()
+        self._reader_states: list = []
+
+    def read_lock(self):
+        """进入 RCU 读临界区（无锁遍历前调用）"""
+        state = getattr(self._tls, 'state', None)
+        if state is None:
+            # 首次进入：注册本线程（唯一需要拿锁的路径）
+            state = _ReaderState()
+            with self.lock:
+                self._reader_states.append(state)
+            self._tls.state = state
+        state.nesting += 1
+
+    def read_unlock(self):
+        """退出 RCU 读临界区"""
+        self._tls.state.nesting -= 1
+
+    def _readers_quiescent(self) -> bool:
+        """是否所有登记线程都已退出读临界区"""
+        return all(state.nesting == 0 for state in self._reader_states)
+
     def defer_free(self, pt_page: PageTablePage):
         """
         延迟释放页表页
@@ -58,28 +128,46 @@ class RCUReclaimer:
             # 标记为 stale
             pt_page.descriptor.mark_stale()
 
-            # 记录释放时间
-            self.queue.append((time.time(), pt_page))
+            # 挂到当前代，等待整代到期后释放
+            self.current_batch.append(pt_page)
 
     def try_reclaim(self, grace_period: float = 0.001):
         """
         尝试回收超过宽限期的页表页
 
+        当前代开始至今超过宽限期时，上一代整批释放并翻转两代。
+        每个页面实际等待 1~2 个宽限期，保守但正确。
+
+        用 perf_counter_ns 而不是 time.time：单调、分辨率高，
+        且整数比较比浮点减法便宜；时钟在临界区外读取，
+        未到期时（绝大多数调用）完全不触碰锁。
+
         Args:
             grace_period: 宽限期（秒）
         """
+        # 无锁快速路径：读到稍旧的 epoch_start 只会推迟一次回收，无害
+        now = time.perf_counter_ns()
+        if now - self.epoch_start < grace_period * 1e9:
+            return
+
         with self.lock:
-            now = time.time()
-            while self.queue:
-                timestamp, pt_page = self.queue[0]
-                if now - timestamp >= grace_period:
-                    # 超过宽限期，可以安全回收
-                    self.queue.popleft()
-                    # 在 Python 中，让 GC 自动回收即可
-                    # 这里可以添加统计信息
-                else:
-                    # 队列是按时间排序的，后面的还没到期
-                    break
+            # 持锁后复查，避免多个线程同时翻转
+            if now - self.epoch_start < grace_period * 1e9:
+                return
+
+            # 宽限期之外还要求读者静止：有线程仍在无锁遍历时
+            # 不能翻转，否则上一代页面可能正被它引用
+            if not self._readers_quiescent():
+                return
+
+            # 上一代已度过完整的宽限期且无活跃读者，可以安全回收：
+            # 重置后放回缓存池供新页表页复用（池满则直接丢弃给 GC）
+            for pt_page in self.prev_batch:
+                pt_page.reset()
+                _page_pool.append(pt_page)
+            self.prev_batch = self.current_batch
+            self.current_batch = []
+            self.epoch_start = now
 
 
 # ============================================================================
@@ -120,24 +208,68 @@ class AddrSpace:
         # RCU 回收器
         self.rcu_reclaimer = RCUReclaimer()
 
-        # 全局锁（用于结构性修改，如创建新页表页）
-        # 注意：这个锁只用于树结构修改，不保护数据访问
-        self.structure_lock = threading.Lock()
+        # 结构锁（用于结构性修改，如创建新页表页）
+        # 按顶级页表槽位分片：不同 PGD 槽位下的子树结构互不相交，
+        # 各自的创建/删除可以并发进行，不再挤一把全局锁
+        # 注意：这些锁只用于树结构修改，不保护数据访问
+        self.structure_locks = [threading.Lock() for _ in range(PTES_PER_PAGE)]
 
         # 物理页分配器（简单的计数器）
         self.next_pfn = 0x1000  # 从 0x1000 开始分配
         self.pfn_lock = threading.Lock()
 
+        # 每线程页框小仓库（jemalloc tcache 风格）：
+        # 单页分配先从本线程缓存弹出，空了才拿一次 pfn_lock
+        # 整批补充。多线程并发缺页不再每页都在全局分配器上碰撞
+        self._pfn_tls = threading.local()
+
+        # 页游走缓存（Paging-Structure Cache）：
+        # vaddr 的高位（2MB 窗口号）直接映射到叶子页表，
+        # 连续操作相邻地址时命中缓存，免去每次从根走 4 级。
+        # 对应硬件 PWC 的软件版本；删除页表时同步失效
+        self._pwc = {}
+
+    # 每线程仓库一次补充的页框数：批量越大锁竞争越少，
+    # 代价是线程退出时最多滞留这么多未用的页框号
+    _PFN_REFILL = 32
+
     def allocate_pfn(self) -> int:
         """
         分配一个物理页框号
 
+        快路径完全无锁：从本线程的页框仓库弹出一个；
+        仓库空了才在 pfn_lock 下一次预留 _PFN_REFILL 个
+
         Returns:
             物理页框号
         """
+        cache = getattr(self._pfn_tls, 'cache', None)
+        if cache:
+            return cache.pop()
+
         with self.pfn_lock:
             pfn = self.next_pfn
-            self.next_pfn += 1
+            self.next_pfn += self._PFN_REFILL
+        # 第一个直接返回，其余留在本线程仓库
+        self._pfn_tls.cache = list(range(pfn + 1, pfn + self._PFN_REFILL))
+        return pfn
+
+    def allocate_pfn_range(self, count: int) -> int:
+        """
+        一次性预留 count 个连续的物理页框号
+
+        批量建立映射时只需获取一次 pfn_lock，
+        而不是每个页面竞争一次
+
+        Args:
+            count: 要预留的页框数量
+
+        Returns:
+            预留区间的第一个 pfn，后续 pfn 依次递增
+        """
+        with self.pfn_lock:
+            pfn = self.next_pfn
+            self.next_pfn += count
             return pfn
 
     def _traverse_rcu(self, vaddr: int) -> Optional[PageTablePage]:
@@ -170,9 +302,10 @@ class AddrSpace:
         current = self.root
 
         # 从根开始向下遍历，不加锁
-        for i, index in enumerate(indices[:-1]):
+        # 直接查 children 字典，跳过 get_child 的方法调用和断言
+        for index in indices[:-1]:
             # 读取子页表（可能读到旧值或新值）
-            child = current.get_child(index)
+            child = current.children.get(index)
 
             if child is None:
                 # 页表页不存在
@@ -184,7 +317,7 @@ class AddrSpace:
         # 返回找到的叶子页表（可能是 stale 的）
         return current
 
-    def _lock_and_validate(self, pt_page: PageTablePage) -> bool:
+    def _lock_and_validate(self, pt_page: PageTablePage, write: bool = True) -> bool:
         """
         Lock & Validate - 获取锁并验证节点是否有效
 
@@ -201,17 +334,26 @@ class AddrSpace:
 
         Args:
             pt_page: 要锁定的页表页
+            write: True 取写锁（独占），False 取读锁（只读游标可并发）
 
         Returns:
             True if valid, False if stale (需要重试)
         """
-        # 获取锁
-        pt_page.descriptor.lock.acquire()
+        lock = pt_page.descriptor.lock
+
+        # 获取锁（读写模式由调用者决定）
+        if write:
+            lock.acquire_write()
+        else:
+            lock.acquire_read()
 
         # 检查是否在我们获取锁之前被标记为 stale
         if pt_page.descriptor.is_stale:
             # 节点已过时，释放锁并返回失败
-            pt_page.descriptor.lock.release()
+            if write:
+                lock.release_write()
+            else:
+                lock.release_read()
             return False
 
         # 节点有效，保持锁定状态
@@ -233,27 +375,34 @@ class AddrSpace:
             pt_page: 根页表页（已锁定）
             locked_pages: 已锁定页表页列表（输出参数）
         """
+        # 显式栈代替递归：深子树不再受 Python 递归深度和
+        # 每层函数调用开销的影响，锁定顺序仍保证父先于子。
+        # 子节点在锁定成功后立即记入 locked_pages，
+        # 这样即使中途抛异常，调用者也能释放所有已获取的锁
         locked_pages.append(pt_page)
 
-        # 如果是叶子节点，直接返回
-        if pt_page.is_leaf():
-            return
+        stack = [] if pt_page.is_leaf() else [pt_page]
+        while stack:
+            page = stack.pop()
 
-        # 遍历所有子节点
-        for i in range(PTES_PER_PAGE):
-            child = pt_page.get_child(i)
-            if child is not None:
+            # 一次性收集该层的子节点（字典只存在非空项），
+            # 按描述符序号排序后再逐个锁定：所有线程以同一全序
+            # 获取锁，不再依赖调用方自觉维持加锁顺序
+            children = sorted(page.children.values(), key=_descriptor_ord)
+            for child in children:
                 # 锁定子节点
                 if self._lock_and_validate(child):
-                    # 递归锁定子树
-                    self._dfs_lock_subtree(child, locked_pages)
+                    locked_pages.append(child)
+                    if not child.is_leaf():
+                        stack.append(child)
                 else:
                     # 子节点 stale，这不应该发生（父节点已锁定）
                     # 在真实系统中这里应该恐慌
                     raise RuntimeError("Unexpected stale child while parent is locked")
 
     @contextlib.contextmanager
-    def lock(self, vaddr_start: int, vaddr_end: int, deep: bool = False):
+    def lock(self, vaddr_start: int, vaddr_end: int, deep: bool = False,
+             write: bool = True):
         """
         锁定地址范围并返回 RCursor
 
@@ -279,6 +428,8 @@ class AddrSpace:
             vaddr_start: 起始地址
             vaddr_end: 结束地址
             deep: 是否深度锁定子树
+            write: True 取写锁；纯查询的调用者传 False 取读锁，
+                   同一页表页上的多个只读游标可以并发
 
         Yields:
             RCursor 对象
@@ -289,8 +440,12 @@ class AddrSpace:
                 cursor.map(0x1000, pfn=0x5000)
         """
         # 确保地址对齐
-        vaddr_start = vaddr_start & ~0xFFF
-        vaddr_end = (vaddr_end + 0xFFF) & ~0xFFF
+        vaddr_start = vaddr_start & PAGE_MASK
+        vaddr_end = (vaddr_end + PAGE_SIZE - 1) & PAGE_MASK
+
+        # 深度锁定意味着要修改子树，强制写模式
+        if deep:
+            write = True
 
         # 重试循环（处理 stale 情况）
         max_retries = 10
@@ -298,18 +453,29 @@ class AddrSpace:
             # === Traverse Phase（无锁）===
             # 简化版本：只处理单个页表页
             # 真实系统需要找到覆盖整个范围的所有页表页
-            pt_page = self._ensure_leaf_page(vaddr_start)
+            # 读临界区覆盖"遍历到拿到页锁"这段窗口：
+            # 期间回收器不会释放任何 stale 页表页
+            self.rcu_reclaimer.read_lock()
+            try:
+                pt_page = self._ensure_leaf_page(vaddr_start)
 
-            if pt_page is None:
-                # 页表页不存在，需要创建
-                pt_page = self._create_leaf_page(vaddr_start)
+                if pt_page is None:
+                    # 页表页不存在，需要创建
+                    pt_page = self._create_leaf_page(vaddr_start)
 
-            # === Lock & Validate ===
-            if not self._lock_and_validate(pt_page):
+                # === Lock & Validate ===
+                # 拿到锁并确认非 stale 后，删除方必须先获取
+                # 这把锁才能标记 stale，之后就无需读临界区保护
+                valid = self._lock_and_validate(pt_page, write=write)
+            finally:
+                self.rcu_reclaimer.read_unlock()
+
+            if not valid:
                 # 节点 stale，重试
                 continue
 
             # === DFS Locking（可选）===
+            # 深度锁定意味着要修改子树，只支持写模式
             locked_pages = []
             if deep:
                 try:
@@ -317,13 +483,13 @@ class AddrSpace:
                 except:
                     # 锁定失败，释放所有已获取的锁
                     for page in locked_pages:
-                        page.descriptor.lock.release()
+                        page.descriptor.lock.release_write()
                     continue
             else:
                 locked_pages = [pt_page]
 
             # === 创建并返回 RCursor ===
-            cursor = RCursor(vaddr_start, vaddr_end)
+            cursor = RCursor(vaddr_start, vaddr_end, write=write)
             for page in locked_pages:
                 cursor.add_locked_page(page)
 
@@ -340,6 +506,80 @@ class AddrSpace:
         # 重试次数耗尽
         raise RuntimeError(f"Failed to lock address range after {max_retries} retries")
 
+    def lock_page(self, vaddr_start: int, vaddr_end: int,
+                  write: bool = True) -> RCursor:
+        """
+        lock() 的非 context-manager 快路径（缺页处理等最热入口用）
+
+        with lock(...) 每次都要经由 contextlib 生成器进出两次，
+        在每秒数十万次的缺页路径上这份解释器开销可观。这里走同样的
+        traverse + lock & validate 流程，但直接返回已锁定的 RCursor；
+        调用方负责在 try/finally 里调用 cursor.release() 并触发
+        rcu_reclaimer.try_reclaim()
+
+        Args:
+            vaddr_start: 起始地址（按页对齐）
+            vaddr_end: 结束地址
+            write: 锁模式，同 lock()
+
+        Returns:
+            已锁定单个叶子页表的 RCursor
+        """
+        for retry in range(10):
+            self.rcu_reclaimer.read_lock()
+            try:
+                pt_page = self._ensure_leaf_page(vaddr_start)
+                if pt_page is None:
+                    pt_page = self._create_leaf_page(vaddr_start)
+                valid = self._lock_and_validate(pt_page, write=write)
+            finally:
+                self.rcu_reclaimer.read_unlock()
+
+            if valid:
+                cursor = RCursor(vaddr_start, vaddr_end, write=write)
+                cursor.add_locked_page(pt_page)
+                return cursor
+
+        raise RuntimeError("Failed to lock page after 10 retries")
+
+    def find_leaf(self, vaddr: int) -> Optional[PageTablePage]:
+        """
+        查找覆盖 vaddr 的叶子页表（只读，不存在时不创建）
+
+        供调用方在取锁前探测一段范围是否有任何映射：
+        基数树的 children 字典只存非空槽位，空范围的探测
+        在第一个缺失的中间节点就结束，与范围大小无关
+        """
+        return self._ensure_leaf_page(vaddr)
+
+    def query_status(self, vaddr: int) -> Status:
+        """
+        无锁查询单个地址的状态（seqlock 读侧入口）
+
+        纯状态查询不必取描述符锁：在 RCU 读窗口内无锁找到叶子，
+        经 RCursor.query_lockless 按 seqlock 协议采样状态字节。
+        与 lock(write=False) 的读游标相比，连共享锁的
+        Condition 往返也省掉了
+
+        Args:
+            vaddr: 虚拟地址
+
+        Returns:
+            该地址的状态（未映射范围返回 Invalid）
+        """
+        page_vaddr = vaddr & PAGE_MASK
+        self.rcu_reclaimer.read_lock()
+        try:
+            pt_page = self._ensure_leaf_page(page_vaddr)
+            if pt_page is None:
+                return Status.Invalid
+            # 未锁定的只读游标：locked_pages 为空，release 无事可做
+            cursor = RCursor(page_vaddr, page_vaddr + PAGE_SIZE, write=False)
+            cursor._leaf = pt_page
+            return cursor.query_lockless(vaddr)
+        finally:
+            self.rcu_reclaimer.read_unlock()
+
     def _ensure_leaf_page(self, vaddr: int) -> Optional[PageTablePage]:
         """
         确保叶子页表页存在（不创建）
@@ -350,15 +590,24 @@ class AddrSpace:
         Returns:
             叶子页表页或 None
         """
+        # 先查页游走缓存：命中且未过时就跳过整个树遍历
+        pwc_key = vaddr >> 21
+        leaf = self._pwc.get(pwc_key)
+        if leaf is not None and not leaf.descriptor.is_stale:
+            return leaf
+
         indices = parse_vaddr(vaddr, self.levels)
         current = self.root
 
-        for i, index in enumerate(indices[:-1]):
-            child = current.get_child(index)
+        # 与 _traverse_rcu 一样直接查字典，省掉方法调用
+        for index in indices[:-1]:
+            child = current.children.get(index)
             if child is None:
                 return None
             current = child
 
+        # 安装缓存供后续相邻地址的操作命中
+        self._pwc[pwc_key] = current
         return current
 
     def _create_leaf_page(self, vaddr: int) -> PageTablePage:
@@ -373,22 +622,124 @@ class AddrSpace:
         Returns:
             新创建的叶子页表页
         """
-        with self.structure_lock:
-            indices = parse_vaddr(vaddr, self.levels)
+        indices = parse_vaddr(vaddr, self.levels)
+
+        # 只锁住该地址所属的顶级槽位，其它槽位下的创建可并发
+        with self.structure_locks[indices[0]]:
             current = self.root
 
             # 从根开始，确保路径上所有节点都存在
             for i, index in enumerate(indices[:-1]):
-                child = current.get_child(index)
+                child = current.children.get(index)
                 if child is None:
                     # 创建新的页表页
                     new_level = self.levels - 2 - i
-                    child = PageTablePage(level=new_level)
-                    current.set_child(index, child)
+                    child = _new_page(new_level)
+                    current.children[index] = child
                 current = child
 
+            # 新建的叶子立即进入页游走缓存
+            self._pwc[vaddr >> 21] = current
             return current
 
+    def mark_huge(self, vaddr: int, soft_perm: int = 0b111) -> bool:
+        """
+        在 PMD（level-1）页表项上标记一个 2MB 大页（延迟分配）
+
+        大页在 PMD 项上终结页表游走：该 2MB 窗口不再需要
+        叶子页表，省下 512 个 PTE 对象，也减少 TLB 压力。
+        元数据与 4KB 路径同构：状态 PrivateAnon，缺页时才分配
+        物理页框块。
+
+        Args:
+            vaddr: 2MB 对齐的起始地址
+            soft_perm: 软件权限
+
+        Returns:
+            成功返回 True；该窗口已有 4KB 叶子页表时返回 False
+            （调用方应回退到小页路径）
+        """
+        assert vaddr % HUGE_PAGE_SIZE == 0, "huge page must be 2MB aligned"
+        indices = parse_vaddr(vaddr, self.levels)
+
+        with self.structure_locks[indices[0]]:
+            # 走到/创建 PMD 页
+            current = self.root
+            for index in indices[:-2]:
+                child = current.children.get(index)
+                if child is None:
+                    child = _new_page(current.level - 1)
+                    current.children[index] = child
+                current = child
+
+            pmd_index = indices[-2]
+            if current.children.get(pmd_index) is not None:
+                # 已有 4KB 叶子，不能覆盖
+                return False
+
+            descriptor = current.descriptor
+            descriptor.lock.acquire_write()
+            try:
+                descriptor.write_begin()
+                pte = current.get_pte(pmd_index)
+                pte.huge = True
+                metadata = descriptor.metadata(pmd_index)
+                metadata.status = Status.PrivateAnon
+                metadata.soft_perm = soft_perm
+                descriptor.write_end()
+            finally:
+                descriptor.lock.release_write()
+            return True
+
+    def find_huge(self, vaddr: int):
+        """
+        查找覆盖 vaddr 的大页 PMD 项（无锁遍历）
+
+        Returns:
+            (PMD 页表页, 项索引)，没有大页映射时返回 None
+        """
+        indices = parse_vaddr(vaddr, self.levels)
+        current = self.root
+        for index in indices[:-2]:
+            child = current.children.get(index)
+            if child is None:
+                return None
+            current = child
+
+        pmd_index = indices[-2]
+        if current.pte_words[pmd_index] & PTE_HUGE:
+            return (current, pmd_index)
+        return None
+
+    def clear_huge(self, vaddr: int) -> bool:
+        """
+        解除一个 2MB 大页映射
+
+        Returns:
+            是否确实存在并清除了大页
+        """
+        found = self.find_huge(vaddr)
+        if found is None:
+            return False
+
+        pmd_page, pmd_index = found
+        descriptor = pmd_page.descriptor
+        descriptor.lock.acquire_write()
+        try:
+            pte = pmd_page.get_pte(pmd_index)
+            if not pte.huge:
+                return False
+            descriptor.write_begin()
+            pte.clear()
+            metadata = descriptor.metadata(pmd_index)
+            metadata.status = Status.Invalid
+            metadata.soft_perm = 0
+            metadata.refcount = 0
+            descriptor.write_end()
+        finally:
+            descriptor.lock.release_write()
+        return True
+
     def remove_page_table(self, vaddr: int):
         """
         删除页表页（模拟 munmap 导致的页表收缩）
@@ -403,27 +754,30 @@ class AddrSpace:
         Args:
             vaddr: 要删除的地址
         """
-        with self.structure_lock:
-            indices = parse_vaddr(vaddr, self.levels)
+        indices = parse_vaddr(vaddr, self.levels)
+
+        # 只锁住该地址所属的顶级槽位
+        with self.structure_locks[indices[0]]:
             parent = self.root
 
             # 找到父节点和目标节点
-            for i, index in enumerate(indices[:-2]):
-                child = parent.get_child(index)
+            for index in indices[:-2]:
+                child = parent.children.get(index)
                 if child is None:
                     return  # 不存在
                 parent = child
 
             # 获取目标节点
             target_index = indices[-2]
-            target = parent.get_child(target_index)
+            target = parent.children.get(target_index)
 
             if target is not None:
                 # 锁定目标节点
                 target.descriptor.lock.acquire()
 
-                # 从父节点断开
-                parent.set_child(target_index, None)
+                # 从父节点断开，并使页游走缓存失效
+                del parent.children[target_index]
+                self._pwc.pop(vaddr >> 21, None)
 
                 # 释放锁
                 target.descriptor.lock.release()
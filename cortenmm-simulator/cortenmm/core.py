@@ -21,10 +21,11 @@ CortenMM Core Data Structures
    - 两者通过结构绑定，保证同步更新
 """
 
+import itertools
 import threading
-from enum import Enum
-from typing import Optional, List
-from dataclasses import dataclass, field
+from array import array
+from enum import IntEnum
+from typing import Dict, Optional, List
 
 
 # ============================================================================
@@ -37,40 +38,92 @@ PTES_PER_PAGE = 512
 # 页面大小（4KB）
 PAGE_SIZE = 4096
 
+# 页对齐掩码：vaddr & PAGE_MASK 向下对齐到页边界
+# 统一用命名常量，避免各处散落手写的 ~0xFFF / 0xFFF 魔法数
+PAGE_MASK = ~(PAGE_SIZE - 1)
+
+# 2MB 大页：level-1（PMD）页表项直接映射 512 个连续 4KB 页
+HUGE_PAGE_SIZE = PTES_PER_PAGE * PAGE_SIZE
+HUGE_PAGE_MASK = ~(HUGE_PAGE_SIZE - 1)
+
 
 # ============================================================================
 # 枚举类型：内存状态
 # ============================================================================
 
-class Status(Enum):
+class Status(IntEnum):
     """
     内存条目的状态枚举
 
     这些状态完全在软件层面维护，硬件页表只知道 Present/Not-Present
     CortenMM 通过 PageDescriptor 将这些状态与硬件 PTE 关联
+
+    IntEnum：成员本身就是 SoA 数组里存的小整数，
+    比较和写入都是普通 int 操作，不经过 Enum.__eq__。
+    0 必须是 Invalid：清零的数组即表示"全部无效"
     """
 
     # 无效状态：该地址范围未被使用
-    Invalid = "Invalid"
+    Invalid = 0
 
     # 已映射：存在有效的硬件映射（PTE.Present = 1）
-    Mapped = "Mapped"
+    Mapped = 1
 
     # 私有匿名页：已分配但可能未映射（延迟分配）
-    PrivateAnon = "PrivateAnon"
+    PrivateAnon = 2
 
     # 写时复制：多个进程共享，写入时需要复制
-    COW = "COW"
+    COW = 3
 
     # 文件映射（可扩展）
-    FileMapped = "FileMapped"
+    FileMapped = 4
+
+    def __str__(self):
+        # Python 3.11 起 IntEnum 默认按整数打印，
+        # 示例输出里仍希望看到状态名
+        return f"Status.{self.name}"
+
+
+# 整数编码 -> 枚举成员（按值索引，比 Status(code) 构造调用便宜）
+_STATUS_MEMBERS = tuple(Status)
+
+# SoA 数组的零值模板：新建描述符时整段复制（C 层 memcpy），
+# 不再逐项构造 512 个元数据对象
+_EMPTY_CODES = array('B', bytes(PTES_PER_PAGE))
+_EMPTY_COUNTS = array('I', (0,)) * PTES_PER_PAGE
 
 
 # ============================================================================
 # PTE：模拟硬件页表条目
 # ============================================================================
 
-@dataclass
+# 硬件标志位（仿 x86 页表项的低位布局）
+PTE_PRESENT = 1 << 0   # 是否存在物理映射
+PTE_RW = 1 << 1        # 是否可写
+PTE_USER = 1 << 2      # 用户态是否可访问
+PTE_ACCESSED = 1 << 3  # 是否被访问过
+PTE_DIRTY = 1 << 4     # 是否被写入过
+PTE_HUGE = 1 << 5      # PMD 项直接映射 2MB 大页
+PTE_PFN_SHIFT = 12     # pfn 存放在高位（bit 12 起）
+
+# 整页 PTE 数组的默认值模板（user 位默认置位），初始化一次 memcpy
+_EMPTY_PTES = array('Q', (PTE_USER,)) * PTES_PER_PAGE
+
+# __repr__ 的标志串查表：RW/U/D/H 四个位共 16 种组合一次性预生成，
+# 打印时一次下标访问，不再每次建列表再 join
+_FLAG_STR = tuple(
+    '/'.join(name for name, bit in (('RW', 1), ('U', 2), ('D', 4), ('H', 8))
+             if i & bit)
+    for i in range(16)
+)
+
+# 软件权限位的同类查表（R/W/X 三个位，8 种组合）
+_PERM_STR = tuple(
+    ''.join(c for c, bit in zip('RWX', (1, 2, 4)) if i & bit) or '---'
+    for i in range(8)
+)
+
+
 class PTE:
     """
     Page Table Entry - 模拟硬件页表条目
@@ -79,77 +132,230 @@ class PTE:
     - pfn: 物理页框号（Physical Frame Number）
     - flags: 硬件标志位（Present, RW, User, etc.）
 
+    存储布局：整个页表页的 512 个条目打包在一个 array('Q') 里
+    （见 PageTablePage.pte_words），每项一个 uint64，按硬件布局
+    编码 pfn 和标志位。本类是 (words, index) 的轻量视图，
+    属性读写直接落到对应的位段。批量清除因此可以整段切片赋值
+
     注意：硬件不知道这个页面是 COW 还是 PrivateAnon，
     这些信息存储在 PageDescriptor 的元数据中
     """
 
-    pfn: Optional[int] = None  # 物理页框号，None 表示未映射
-    present: bool = False       # Present bit：是否存在物理映射
-    rw: bool = False           # Read/Write bit：是否可写
-    user: bool = True          # User bit：用户态是否可访问
-    accessed: bool = False     # Accessed bit：是否被访问过
-    dirty: bool = False        # Dirty bit：是否被写入过
+    __slots__ = ('_words', '_index')
+
+    def __init__(self, words: array, index: int):
+        self._words = words
+        self._index = index
+
+    # --- pfn（bit 12 起；pfn 分配从 0x1000 开始，0 表示未设置）---
+    @property
+    def pfn(self) -> Optional[int]:
+        value = self._words[self._index] >> PTE_PFN_SHIFT
+        return value if value else None
+
+    @pfn.setter
+    def pfn(self, value: Optional[int]):
+        word = self._words[self._index] & ((1 << PTE_PFN_SHIFT) - 1)
+        if value is not None:
+            word |= value << PTE_PFN_SHIFT
+        self._words[self._index] = word
+
+    def _get_flag(self, flag: int) -> bool:
+        return bool(self._words[self._index] & flag)
+
+    def _set_flag(self, flag: int, value: bool):
+        if value:
+            self._words[self._index] |= flag
+        else:
+            self._words[self._index] &= ~flag
+
+    # --- 标志位 ---
+    @property
+    def present(self) -> bool:
+        return self._get_flag(PTE_PRESENT)
+
+    @present.setter
+    def present(self, value: bool):
+        self._set_flag(PTE_PRESENT, value)
+
+    @property
+    def rw(self) -> bool:
+        return self._get_flag(PTE_RW)
+
+    @rw.setter
+    def rw(self, value: bool):
+        self._set_flag(PTE_RW, value)
+
+    @property
+    def user(self) -> bool:
+        return self._get_flag(PTE_USER)
+
+    @user.setter
+    def user(self, value: bool):
+        self._set_flag(PTE_USER, value)
+
+    @property
+    def accessed(self) -> bool:
+        return self._get_flag(PTE_ACCESSED)
+
+    @accessed.setter
+    def accessed(self, value: bool):
+        self._set_flag(PTE_ACCESSED, value)
+
+    @property
+    def dirty(self) -> bool:
+        return self._get_flag(PTE_DIRTY)
+
+    @dirty.setter
+    def dirty(self, value: bool):
+        self._set_flag(PTE_DIRTY, value)
+
+    @property
+    def huge(self) -> bool:
+        return self._get_flag(PTE_HUGE)
+
+    @huge.setter
+    def huge(self, value: bool):
+        self._set_flag(PTE_HUGE, value)
 
     def clear(self):
-        """清除 PTE，模拟 unmap 操作"""
-        self.pfn = None
-        self.present = False
-        self.rw = False
-        self.accessed = False
-        self.dirty = False
+        """清除 PTE，模拟 unmap 操作（保留 user 默认位）"""
+        self._words[self._index] = PTE_USER
 
     def is_valid(self) -> bool:
         """检查 PTE 是否有效"""
-        return self.present and self.pfn is not None
+        word = self._words[self._index]
+        return bool(word & PTE_PRESENT) and (word >> PTE_PFN_SHIFT) != 0
 
     def __repr__(self):
-        if not self.present:
+        word = self._words[self._index]
+        if not word & PTE_PRESENT:
             return "PTE(Not-Present)"
-        flags = []
-        if self.rw:
-            flags.append("RW")
-        if self.user:
-            flags.append("U")
-        if self.dirty:
-            flags.append("D")
-        return f"PTE(pfn={self.pfn}, {'/'.join(flags)})"
+        # 把 RW/U/D/H 位压缩成 4 位查表键（位 1,2 和位 4,5）
+        key = ((word >> 1) & 0b0011) | ((word >> 2) & 0b1100)
+        return f"PTE(pfn={self.pfn}, {_FLAG_STR[key]})"
 
 
 # ============================================================================
 # PTEMetadata：每个 PTE 的软件元数据
 # ============================================================================
 
-@dataclass
 class PTEMetadata:
     """
     每个 PTE 的软件元数据
 
     这是 CortenMM 的关键创新：将软件状态直接与硬件 PTE 绑定
     而不是在一个独立的 VMA 树中维护
+
+    存储布局：真正的数据放在 PageDescriptor 的 SoA 数组里
+    （见 status_codes / soft_perms / refcounts），本类只是
+    (descriptor, index) 的轻量视图，属性读写直接落到数组元素。
+    这让批量操作可以整段读写数组，而单点访问保持原有的
+    metadata.status / metadata.soft_perm / metadata.refcount 接口
     """
 
-    # 软件状态（Invalid, Mapped, PrivateAnon, COW 等）
-    status: Status = Status.Invalid
+    __slots__ = ('_descriptor', '_index')
+
+    def __init__(self, descriptor: 'PageDescriptor', index: int):
+        self._descriptor = descriptor
+        self._index = index
+
+    # --- 软件状态（Invalid, Mapped, PrivateAnon, COW 等）---
+    @property
+    def status(self) -> Status:
+        return _STATUS_MEMBERS[self._descriptor.status_codes[self._index]]
 
-    # 软件权限（可能与硬件权限不同，例如 COW 页在软件层面可写）
-    soft_perm: int = 0  # bit 0: read, bit 1: write, bit 2: exec
+    @status.setter
+    def status(self, value: Status):
+        self._descriptor.status_codes[self._index] = value
 
-    # 引用计数（用于 COW）
-    refcount: int = 0
+    # --- 软件权限（bit 0: read, bit 1: write, bit 2: exec）---
+    # 可能与硬件权限不同，例如 COW 页在软件层面可写
+    @property
+    def soft_perm(self) -> int:
+        return self._descriptor.soft_perms[self._index]
 
-    # 文件映射相关（可扩展）
-    file_offset: Optional[int] = None
+    @soft_perm.setter
+    def soft_perm(self, value: int):
+        self._descriptor.soft_perms[self._index] = value
+
+    # --- 引用计数（用于 COW）---
+    @property
+    def refcount(self) -> int:
+        return self._descriptor.refcounts[self._index]
+
+    @refcount.setter
+    def refcount(self, value: int):
+        self._descriptor.refcounts[self._index] = value
+
+    # --- 文件映射相关（可扩展，稀疏存储）---
+    @property
+    def file_offset(self) -> Optional[int]:
+        return self._descriptor.file_offsets.get(self._index)
+
+    @file_offset.setter
+    def file_offset(self, value: Optional[int]):
+        if value is None:
+            self._descriptor.file_offsets.pop(self._index, None)
+        else:
+            self._descriptor.file_offsets[self._index] = value
 
     def __repr__(self):
-        perm = []
-        if self.soft_perm & 1:
-            perm.append("R")
-        if self.soft_perm & 2:
-            perm.append("W")
-        if self.soft_perm & 4:
-            perm.append("X")
-        perm_str = ''.join(perm) if perm else "---"
-        return f"Meta(status={self.status.value}, perm={perm_str}, ref={self.refcount})"
+        return (f"Meta(status={self.status.name}, "
+                f"perm={_PERM_STR[self.soft_perm & 7]}, ref={self.refcount})")
+
+
+# ============================================================================
+# RwLock：读写锁
+# ============================================================================
+
+class RwLock:
+    """
+    读写锁 - 多个读者可以并发持有，写者独占
+
+    页表页的典型访问模式是读多写少：缺页查询、状态查询远多于
+    建立/解除映射。普通互斥锁会让并发的只读游标互相阻塞，
+    读写锁允许它们同时进入。
+
+    兼容 threading.Lock 的 acquire/release 接口（等价于写锁），
+    旧的独占调用点无需修改
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def acquire_read(self):
+        """获取读锁（共享）"""
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        """释放读锁"""
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        """获取写锁（独占）"""
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+
+    def release_write(self):
+        """释放写锁"""
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    # 兼容 threading.Lock 接口：默认按独占（写）语义
+    acquire = acquire_write
+    release = release_write
 
 
 # ============================================================================
@@ -175,14 +381,30 @@ class PageDescriptor:
        - 当页表页被删除时，先标记 stale，等待宽限期后再回收
     """
 
-    def __init__(self):
-        # 细粒度锁：只保护这一个页表页
-        self.lock = threading.Lock()
+    # 每个页表页都带一个描述符，实例数量多，省掉 __dict__
+    __slots__ = ('lock', 'ord', 'status_codes', 'soft_perms', 'refcounts',
+                 'file_offsets', 'is_stale', 'version')
+
+    # 全局单调递增的描述符序号：批量加锁按它排序，
+    # 保证所有线程以同一全序获取锁（死锁避免）
+    _ordinals = itertools.count()
 
-        # 每个 PTE 的元数据（512 个）
-        self.per_pte_metadata: List[PTEMetadata] = [
-            PTEMetadata() for _ in range(PTES_PER_PAGE)
-        ]
+    def __init__(self):
+        # 细粒度读写锁：只保护这一个页表页
+        # 只读游标（查询）可以并发持有，修改路径独占
+        self.lock = RwLock()
+
+        # 加锁排序用的稳定序号。父页表总是先于子页表创建，
+        # 因此按序号排序天然满足"父先于子"的锁定顺序
+        self.ord = next(PageDescriptor._ordinals)
+
+        # 每个 PTE 的元数据，按列存储（SoA）：
+        # 512 个元数据对象换成三个紧凑数组 + 一个稀疏字典，
+        # 初始化是一次 memcpy，批量标记/清除可以整段切片赋值
+        self.status_codes = _EMPTY_CODES[:]   # Status 的整数编码
+        self.soft_perms = _EMPTY_CODES[:]     # 软件权限位
+        self.refcounts = _EMPTY_COUNTS[:]     # COW 引用计数
+        self.file_offsets = {}                # 文件偏移（极少数页才有）
 
         # RCU 延迟释放标志
         self.is_stale = False
@@ -190,16 +412,70 @@ class PageDescriptor:
         # 版本号（用于调试和验证）
         self.version = 0
 
+    def metadata(self, index: int) -> PTEMetadata:
+        """返回指定 PTE 的元数据视图"""
+        return PTEMetadata(self, index)
+
+    def fill_status(self, lo: int, hi: int, status: Status, soft_perm: int):
+        """
+        整段设置 [lo, hi) 条目的状态与软件权限
+
+        SoA 布局下批量标记就是两次切片赋值（C 层的连续存储），
+        版本号只递增一次，替代逐条目的属性写入
+        """
+        n = hi - lo
+        self.write_begin()
+        self.status_codes[lo:hi] = array('B', bytes((status,)) * n)
+        self.soft_perms[lo:hi] = array('B', bytes((soft_perm,)) * n)
+        self.write_end()
+
+    def clear_range(self, lo: int, hi: int):
+        """
+        整段清除 [lo, hi) 条目的软件元数据
+
+        批量 unmap 的逆操作：状态/权限/引用计数直接从零值模板
+        切片复制回来，版本号递增一次
+        """
+        self.write_begin()
+        self.status_codes[lo:hi] = _EMPTY_CODES[lo:hi]
+        self.soft_perms[lo:hi] = _EMPTY_CODES[lo:hi]
+        self.refcounts[lo:hi] = _EMPTY_COUNTS[lo:hi]
+        self.write_end()
+
+    def reset(self):
+        """
+        回收复用前重置描述符（配合 addrspace 的页表页缓存池）
+
+        重新取一个全局序号：复用页的序号因此仍大于所有先于它
+        创建的页表页，锁排序的"父先于子"不变式保持成立
+        """
+        self.ord = next(PageDescriptor._ordinals)
+        self.status_codes[:] = _EMPTY_CODES
+        self.soft_perms[:] = _EMPTY_CODES
+        self.refcounts[:] = _EMPTY_COUNTS
+        self.file_offsets.clear()
+        self.is_stale = False
+        self.version = 0
+
     def mark_stale(self):
         """标记为过时，准备进入 RCU 宽限期"""
         self.is_stale = True
 
-    def increment_version(self):
-        """增加版本号（用于检测并发修改）"""
+    def write_begin(self):
+        """
+        进入写临界区（seqlock 写侧）
+
+        版本号变为奇数，表示写入进行中；无锁读者看到奇数版本
+        会重试。写者仍然持有描述符锁，互相之间不会并发
+        """
+        self.version += 1
+
+    def write_end(self):
+        """退出写临界区：版本号恢复偶数，读者可据此确认快照一致"""
         self.version += 1
 
     def __repr__(self):
-        valid_count = sum(1 for m in self.per_pte_metadata if m.status != Status.Invalid)
+        valid_count = sum(1 for code in self.status_codes if code)
         return f"PageDesc(valid={valid_count}/{PTES_PER_PAGE}, stale={self.is_stale}, v{self.version})"
 
 
@@ -212,8 +488,9 @@ class PageTablePage:
     页表页 - 模拟一个硬件页表页
 
     结构设计：
-    1. **硬件部分**（ptes）：
-       - 512 个 PTE 条目，这是 CPU/MMU 实际读取的内容
+    1. **硬件部分**（pte_words）：
+       - 512 个打包成 uint64 的 PTE 条目，这是 CPU/MMU 实际读取的内容
+       - 连续的 C 数组，缓存友好；单项访问经 PTE 视图对象
 
     2. **软件部分**（descriptor）：
        - 关联的 PageDescriptor，包含所有软件元数据
@@ -229,16 +506,21 @@ class PageTablePage:
     - 结果：不需要额外的数据结构来记录内存区域
     """
 
+    __slots__ = ('pte_words', 'descriptor', 'children', 'level')
+
     def __init__(self, level: int = 0):
-        # 硬件 PTE 数组
-        self.ptes: List[PTE] = [PTE() for _ in range(PTES_PER_PAGE)]
+        # 硬件 PTE 数组：打包的 uint64，一次模板复制完成初始化，
+        # 不再构造 512 个 PTE 对象
+        self.pte_words = _EMPTY_PTES[:]
 
         # 关联的软件元数据描述符
         self.descriptor = PageDescriptor()
 
         # 子页表（用于多级页表）
-        # children[i] 是 ptes[i] 指向的下一级页表
-        self.children: List[Optional['PageTablePage']] = [None] * PTES_PER_PAGE
+        # children[i] 是第 i 个条目指向的下一级页表
+        # 稀疏字典：地址空间通常只用到少数槽位，
+        # 不为 512 个空指针各占一个列表槽
+        self.children: Dict[int, 'PageTablePage'] = {}
 
         # 页表级别：0=叶子(PTE), 1=PMD, 2=PUD, 3=PGD
         self.level = level
@@ -247,25 +529,67 @@ class PageTablePage:
         """是否是叶子页表（直接映射物理页）"""
         return self.level == 0
 
+    # 下面几个方法不再做 0 <= index < PTES_PER_PAGE 断言：
+    # 索引都来自 parse_vaddr 或 (vaddr >> 12) & 0x1FF，按构造就在范围内
+
     def get_pte(self, index: int) -> PTE:
-        """获取指定索引的 PTE"""
-        assert 0 <= index < PTES_PER_PAGE
-        return self.ptes[index]
+        """获取指定索引的 PTE（视图对象）"""
+        return PTE(self.pte_words, index)
 
     def get_metadata(self, index: int) -> PTEMetadata:
-        """获取指定索引的元数据"""
-        assert 0 <= index < PTES_PER_PAGE
-        return self.descriptor.per_pte_metadata[index]
+        """获取指定索引的元数据（视图对象）"""
+        return PTEMetadata(self.descriptor, index)
+
+    def clear_ptes(self, lo: int, hi: int):
+        """整段清除 [lo, hi) 的硬件 PTE（从默认模板切片复制）"""
+        self.pte_words[lo:hi] = _EMPTY_PTES[lo:hi]
+
+    def reset(self, level: Optional[int] = None):
+        """回收复用前整页重置（硬件 PTE、子表链接和描述符一并清空）"""
+        self.pte_words[:] = _EMPTY_PTES
+        self.children.clear()
+        if level is not None:
+            self.level = level
+        self.descriptor.reset()
+
+    def cow_protect(self, lo: int, hi: int) -> List[int]:
+        """
+        把 [lo, hi) 内已映射且 present 的条目整批转为 COW 只读
+
+        fork 的批量路径：直接扫描 SoA 状态数组筛出 Mapped 条目，
+        状态改写和硬件位清除在一个 seqlock 写临界区内完成，
+        不再为每个页面构造元数据视图
+
+        Returns:
+            受影响条目的索引列表（供调用方更新引用计数）
+        """
+        # IntEnum 成员直接当整数用
+        code_mapped = int(Status.Mapped)
+        code_cow = int(Status.COW)
+        codes = self.descriptor.status_codes
+        words = self.pte_words
+
+        # 状态数组先整段切片再 enumerate，循环体内不再做两次下标计算
+        hit = [lo + i for i, code in enumerate(codes[lo:hi])
+               if code == code_mapped and words[lo + i] & PTE_PRESENT]
+        if hit:
+            self.descriptor.write_begin()
+            for i in hit:
+                codes[i] = code_cow
+                words[i] &= ~PTE_RW  # 硬件只读，写入触发 COW 异常
+            self.descriptor.write_end()
+        return hit
 
     def get_child(self, index: int) -> Optional['PageTablePage']:
-        """获取子页表"""
-        assert 0 <= index < PTES_PER_PAGE
-        return self.children[index]
+        """获取子页表（热路径直接用 self.children.get，此方法供慢路径/调试用）"""
+        return self.children.get(index)
 
     def set_child(self, index: int, child: Optional['PageTablePage']):
-        """设置子页表"""
-        assert 0 <= index < PTES_PER_PAGE
-        self.children[index] = child
+        """设置子页表（child 为 None 表示断开链接）"""
+        if child is None:
+            self.children.pop(index, None)
+        else:
+            self.children[index] = child
 
     def __repr__(self):
         return f"PTPage(level={self.level}, {self.descriptor})"
@@ -275,31 +599,48 @@ class PageTablePage:
 # 辅助函数：虚拟地址解析
 # ============================================================================
 
-def parse_vaddr(vaddr: int, levels: int = 4) -> List[int]:
+# 各级索引的右移位数，按级数预计算（levels -> 从高级到低级的 shift 序列）
+# 避免每次调用都重建循环变量和反转列表
+_PARSE_SHIFTS = {
+    levels: tuple(9 * i for i in reversed(range(levels)))
+    for levels in (2, 3, 4, 5)
+}
+
+
+def parse_vaddr(vaddr: int, levels: int = 4) -> tuple:
     """
     解析虚拟地址为页表索引
 
     假设 4 级页表，每级 9 bits（512 条目）
     vaddr: [63:48 unused] [47:39 L3] [38:30 L2] [29:21 L1] [20:12 L0] [11:0 offset]
 
+    注意：只需要叶子索引的调用方应直接写 (vaddr >> 12) & 0x1FF，
+    本函数留给需要完整路径的树遍历使用
+
     Args:
         vaddr: 虚拟地址
         levels: 页表级数（默认 4）
 
     Returns:
-        索引列表，从高到低 [L3_idx, L2_idx, L1_idx, L0_idx]
+        索引元组，从高到低 (L3_idx, L2_idx, L1_idx, L0_idx)
     """
-    indices = []
     # 去掉页内偏移（低 12 bits）
     vpn = vaddr >> 12
 
-    # 提取每级索引（每级 9 bits）
-    for _ in range(levels):
-        indices.append(vpn & 0x1FF)  # 取低 9 bits
-        vpn >>= 9
+    # 常见情况（4 级页表）直接展开成四个移位+掩码，无循环无分支
+    if levels == 4:
+        return (
+            (vpn >> 27) & 0x1FF,
+            (vpn >> 18) & 0x1FF,
+            (vpn >> 9) & 0x1FF,
+            vpn & 0x1FF,
+        )
 
-    # 反转，使其从高级到低级
-    return list(reversed(indices))
+    # 其余级数走预计算的移位表
+    shifts = _PARSE_SHIFTS.get(levels)
+    if shifts is None:
+        shifts = tuple(9 * i for i in reversed(range(levels)))
+    return tuple((vpn >> shift) & 0x1FF for shift in shifts)
 
 
 def make_vaddr(indices: List[int], offset: int = 0) -> int:
@@ -326,12 +667,23 @@ def make_vaddr(indices: List[int], offset: int = 0) -> int:
 
 __all__ = [
     'Status',
+    'RwLock',
     'PTE',
+    'PTE_PRESENT',
+    'PTE_RW',
+    'PTE_USER',
+    'PTE_ACCESSED',
+    'PTE_DIRTY',
+    'PTE_HUGE',
+    'PTE_PFN_SHIFT',
     'PTEMetadata',
     'PageDescriptor',
     'PageTablePage',
     'PTES_PER_PAGE',
     'PAGE_SIZE',
+    'PAGE_MASK',
+    'HUGE_PAGE_SIZE',
+    'HUGE_PAGE_MASK',
     'parse_vaddr',
     'make_vaddr',
 ]
@@ -18,14 +18,19 @@ CortenMM Transactional Interface - RCursor
    - with addr_space.lock(...) as cursor: 保证异常安全
 """
 
-import contextlib
-from typing import List, Optional, Tuple, Set
+from typing import List, Optional, Tuple
 from .core import (
-    Status, PTE, PTEMetadata, PageDescriptor, PageTablePage,
-    PTES_PER_PAGE, parse_vaddr, make_vaddr
+    Status, PTE, PTEMetadata, PageTablePage,
+    PTES_PER_PAGE, PAGE_SIZE
 )
 
 
+# 热路径范围校验开关：vaddr 越界属于调用方 bug，默认不在每次
+# query/map/unmap 时做区间比较（即使不加 -O，assert 也要执行
+# 两次属性读取加比较）。排查问题时把它置 True 即可恢复校验
+_DEBUG = False
+
+
 # ============================================================================
 # RCursor：事务性游标
 # ============================================================================
@@ -51,19 +56,34 @@ class RCursor:
        - 防止并发修改导致的不一致
     """
 
-    def __init__(self, vaddr_start: int, vaddr_end: int):
+    # 每次系统调用都会创建一个游标，__slots__ 省掉实例 __dict__，
+    # 属性访问走固定偏移（接近 C 结构体字段读取）
+    __slots__ = ('vaddr_start', 'vaddr_end', 'write',
+                 'locked_pages', '_leaf', '_released')
+
+    def __init__(self, vaddr_start: int, vaddr_end: int, write: bool = True):
         """
         初始化 RCursor
 
         Args:
             vaddr_start: 范围起始地址（包含）
             vaddr_end: 范围结束地址（不包含）
+            write: 持有的是写锁（独占）还是读锁（共享），
+                   release 时按相同模式释放
         """
         self.vaddr_start = vaddr_start
         self.vaddr_end = vaddr_end
 
-        # 持有的锁（页表页 -> 锁对象）
-        self.locked_pages: List[Tuple[PageTablePage, PageDescriptor]] = []
+        # 锁模式（读/写）
+        self.write = write
+
+        # 持有锁的页表页（描述符经 pt_page.descriptor 获取，
+        # 不再为每项分配 (page, descriptor) 元组）
+        self.locked_pages: List[PageTablePage] = []
+
+        # 覆盖该范围的叶子页表（首个锁入的叶子），单点操作
+        # 直接走这个缓存，不再每次线性扫描 locked_pages
+        self._leaf: Optional[PageTablePage] = None
 
         # 是否已经释放
         self._released = False
@@ -75,7 +95,25 @@ class RCursor:
         Args:
             pt_page: 页表页对象
         """
-        self.locked_pages.append((pt_page, pt_page.descriptor))
+        self.locked_pages.append(pt_page)
+        if self._leaf is None and pt_page.is_leaf():
+            self._leaf = pt_page
+
+    def _pte_index_slices(self) -> tuple:
+        """
+        计算游标范围对应的叶子 PTE 索引段
+
+        范围内的索引是连续的（模 512 可能回绕一次），
+        返回一到两个 (lo, hi) 半开区间，供批量操作整段切片
+        """
+        num_pages = (self.vaddr_end - self.vaddr_start + PAGE_SIZE - 1) >> 12
+        lo = (self.vaddr_start >> 12) & 0x1FF
+
+        if num_pages >= PTES_PER_PAGE:
+            return ((0, PTES_PER_PAGE),)
+        if lo + num_pages <= PTES_PER_PAGE:
+            return ((lo, lo + num_pages),)
+        return ((lo, PTES_PER_PAGE), (0, lo + num_pages - PTES_PER_PAGE))
 
     def query(self, vaddr: int) -> Status:
         """
@@ -91,22 +129,56 @@ class RCursor:
         Returns:
             该地址的状态（Invalid, Mapped, PrivateAnon, COW 等）
         """
-        assert self.vaddr_start <= vaddr < self.vaddr_end, \
-            f"Address {hex(vaddr)} out of cursor range"
+        if _DEBUG:
+            assert self.vaddr_start <= vaddr < self.vaddr_end, \
+                f"Address {hex(vaddr)} out of cursor range"
 
-        # 遍历已锁定的页表页，找到覆盖该地址的叶子页表
-        for pt_page, _ in self.locked_pages:
-            if pt_page.is_leaf():
-                # 解析地址，提取页表索引
-                indices = parse_vaddr(vaddr)
-                pte_index = indices[-1]  # 叶子页表的索引
+        # 直接使用缓存的叶子页表
+        pt_page = self._leaf
+        if pt_page is None:
+            # 没有锁定叶子页表，说明该地址范围未被锁定
+            return Status.Invalid
+
+        # 叶子页表索引就是虚拟页号的低 9 位，直接取位，
+        # 不必为单个索引走完整的 parse_vaddr
+        pte_index = (vaddr >> 12) & 0x1FF
 
-                # 读取元数据
-                metadata = pt_page.get_metadata(pte_index)
-                return metadata.status
+        # 读取元数据
+        return pt_page.get_metadata(pte_index).status
 
-        # 如果没有找到，说明该地址范围未被锁定
-        return Status.Invalid
+    def query_lockless(self, vaddr: int) -> Status:
+        """
+        无锁查询指定虚拟地址的状态（seqlock 读侧）
+
+        查询只读一个字节的元数据，没必要为它拿描述符锁。
+        读者采样版本号：偶数版本下读到的值，若读后版本未变，
+        这个快照就是一致的；奇数版本或版本变化说明有写入并发，
+        重试即可。写者照常持锁并用 write_begin/write_end 包住修改
+
+        Args:
+            vaddr: 虚拟地址
+
+        Returns:
+            该地址的状态（Invalid, Mapped, PrivateAnon, COW 等）
+        """
+        if _DEBUG:
+            assert self.vaddr_start <= vaddr < self.vaddr_end, \
+                f"Address {hex(vaddr)} out of cursor range"
+
+        pt_page = self._leaf
+        if pt_page is None:
+            return Status.Invalid
+
+        descriptor = pt_page.descriptor
+        pte_index = (vaddr >> 12) & 0x1FF
+
+        while True:
+            v1 = descriptor.version
+            if v1 & 1 == 0:
+                status = pt_page.get_metadata(pte_index).status
+                if descriptor.version == v1:
+                    return status
+            # 写入进行中或读取期间发生了写入，重试
 
     def map(self, vaddr: int, pfn: int, writable: bool = True):
         """
@@ -122,31 +194,32 @@ class RCursor:
             pfn: 物理页框号
             writable: 是否可写
         """
-        assert self.vaddr_start <= vaddr < self.vaddr_end
+        if _DEBUG:
+            assert self.vaddr_start <= vaddr < self.vaddr_end
 
-        # 找到对应的叶子页表
-        for pt_page, descriptor in self.locked_pages:
-            if pt_page.is_leaf():
-                indices = parse_vaddr(vaddr)
-                pte_index = indices[-1]
+        pt_page = self._leaf
+        if pt_page is None:
+            raise RuntimeError(f"No leaf page table locked for address {hex(vaddr)}")
+
+        pte_index = (vaddr >> 12) & 0x1FF
+        descriptor = pt_page.descriptor
 
-                # 更新硬件 PTE
-                pte = pt_page.get_pte(pte_index)
-                pte.pfn = pfn
-                pte.present = True
-                pte.rw = writable
-                pte.user = True
+        # seqlock 写临界区：版本在写入期间保持奇数
+        descriptor.write_begin()
 
-                # 更新软件元数据
-                metadata = pt_page.get_metadata(pte_index)
-                metadata.status = Status.Mapped
-                metadata.soft_perm = 0b111 if writable else 0b101  # RWX or R-X
+        # 更新硬件 PTE
+        pte = pt_page.get_pte(pte_index)
+        pte.pfn = pfn
+        pte.present = True
+        pte.rw = writable
+        pte.user = True
 
-                # 增加描述符版本号
-                descriptor.increment_version()
-                return
+        # 更新软件元数据
+        metadata = pt_page.get_metadata(pte_index)
+        metadata.status = Status.Mapped
+        metadata.soft_perm = 0b111 if writable else 0b101  # RWX or R-X
 
-        raise RuntimeError(f"No leaf page table locked for address {hex(vaddr)}")
+        descriptor.write_end()
 
     def mark(self, status: Status, soft_perm: int = 0b111):
         """
@@ -165,23 +238,34 @@ class RCursor:
             status: 要设置的状态
             soft_perm: 软件权限
         """
-        # 遍历范围内的所有地址
-        vaddr = self.vaddr_start
-        while vaddr < self.vaddr_end:
-            for pt_page, descriptor in self.locked_pages:
-                if pt_page.is_leaf():
-                    indices = parse_vaddr(vaddr)
-                    pte_index = indices[-1]
+        # 在 SoA 数组上整段切片赋值，不再按 4KB 逐页循环
+        slices = self._pte_index_slices()
+
+        for pt_page in self.locked_pages:
+            if pt_page.is_leaf():
+                descriptor = pt_page.descriptor
+                for seg_lo, seg_hi in slices:
+                    descriptor.fill_status(seg_lo, seg_hi, status, soft_perm)
 
-                    # 只更新元数据，不修改硬件 PTE
-                    metadata = pt_page.get_metadata(pte_index)
-                    metadata.status = status
-                    metadata.soft_perm = soft_perm
+    def cow_protect_range(self) -> List[Tuple[PageTablePage, List[int]]]:
+        """
+        将范围内所有已映射页面整批转为 COW 保护
 
-                    # 增加版本号
-                    descriptor.increment_version()
+        fork 的批量入口：与 mark()/unmap_range() 同样按索引段
+        下推到叶子页表处理，不再按 4KB 逐页取 PTE 和元数据
 
-            vaddr += 4096  # 移动到下一页
+        Returns:
+            (叶子页表, 受影响索引列表) 的列表
+        """
+        slices = self._pte_index_slices()
+        affected = []
+        for pt_page in self.locked_pages:
+            if pt_page.is_leaf():
+                for seg_lo, seg_hi in slices:
+                    hit = pt_page.cow_protect(seg_lo, seg_hi)
+                    if hit:
+                        affected.append((pt_page, hit))
+        return affected
 
     def unmap(self, vaddr: int):
         """
@@ -195,28 +279,30 @@ class RCursor:
         Args:
             vaddr: 要解除映射的虚拟地址
         """
-        assert self.vaddr_start <= vaddr < self.vaddr_end
+        if _DEBUG:
+            assert self.vaddr_start <= vaddr < self.vaddr_end
 
-        for pt_page, descriptor in self.locked_pages:
-            if pt_page.is_leaf():
-                indices = parse_vaddr(vaddr)
-                pte_index = indices[-1]
+        pt_page = self._leaf
+        if pt_page is None:
+            raise RuntimeError(f"No leaf page table locked for address {hex(vaddr)}")
 
-                # 清除硬件 PTE
-                pte = pt_page.get_pte(pte_index)
-                pte.clear()
+        pte_index = (vaddr >> 12) & 0x1FF
+        descriptor = pt_page.descriptor
 
-                # 重置元数据
-                metadata = pt_page.get_metadata(pte_index)
-                metadata.status = Status.Invalid
-                metadata.soft_perm = 0
-                metadata.refcount = 0
+        # seqlock 写临界区
+        descriptor.write_begin()
 
-                # 增加版本号
-                descriptor.increment_version()
-                return
+        # 清除硬件 PTE
+        pte = pt_page.get_pte(pte_index)
+        pte.clear()
 
-        raise RuntimeError(f"No leaf page table locked for address {hex(vaddr)}")
+        # 重置元数据
+        metadata = pt_page.get_metadata(pte_index)
+        metadata.status = Status.Invalid
+        metadata.soft_perm = 0
+        metadata.refcount = 0
+
+        descriptor.write_end()
 
     def unmap_range(self):
         """
@@ -224,30 +310,15 @@ class RCursor:
 
         批量 unmap 操作，用于 munmap 系统调用
         """
-        vaddr = self.vaddr_start
-        while vaddr < self.vaddr_end:
-            # 尝试 unmap，如果地址无效则跳过
-            try:
-                for pt_page, descriptor in self.locked_pages:
-                    if pt_page.is_leaf():
-                        indices = parse_vaddr(vaddr)
-                        pte_index = indices[-1]
-
-                        # 检查是否有效
-                        metadata = pt_page.get_metadata(pte_index)
-                        if metadata.status != Status.Invalid:
-                            # 清除 PTE 和元数据
-                            pte = pt_page.get_pte(pte_index)
-                            pte.clear()
-                            metadata.status = Status.Invalid
-                            metadata.soft_perm = 0
-                            metadata.refcount = 0
-                            descriptor.increment_version()
-                        break
-            except:
-                pass
-
-            vaddr += 4096
+        # 与 mark() 对称：软硬件状态都整段切片清零，
+        # 每个叶子一次版本递增
+        slices = self._pte_index_slices()
+
+        for pt_page in self.locked_pages:
+            if pt_page.is_leaf():
+                for seg_lo, seg_hi in slices:
+                    pt_page.clear_ptes(seg_lo, seg_hi)
+                    pt_page.descriptor.clear_range(seg_lo, seg_hi)
 
     def get_pte_and_metadata(self, vaddr: int) -> Optional[Tuple[PTE, PTEMetadata]]:
         """
@@ -259,17 +330,15 @@ class RCursor:
         Returns:
             (PTE, PTEMetadata) 或 None
         """
-        assert self.vaddr_start <= vaddr < self.vaddr_end
+        if _DEBUG:
+            assert self.vaddr_start <= vaddr < self.vaddr_end
 
-        for pt_page, _ in self.locked_pages:
-            if pt_page.is_leaf():
-                indices = parse_vaddr(vaddr)
-                pte_index = indices[-1]
-                pte = pt_page.get_pte(pte_index)
-                metadata = pt_page.get_metadata(pte_index)
-                return (pte, metadata)
+        pt_page = self._leaf
+        if pt_page is None:
+            return None
 
-        return None
+        pte_index = (vaddr >> 12) & 0x1FF
+        return (pt_page.get_pte(pte_index), pt_page.get_metadata(pte_index))
 
     def release(self):
         """
@@ -280,11 +349,16 @@ class RCursor:
         if self._released:
             return
 
-        # 按相反顺序释放锁（避免死锁）
-        for pt_page, descriptor in reversed(self.locked_pages):
-            descriptor.lock.release()
+        # 按相反顺序、以获取时的模式释放锁（避免死锁）
+        if self.write:
+            for pt_page in reversed(self.locked_pages):
+                pt_page.descriptor.lock.release_write()
+        else:
+            for pt_page in reversed(self.locked_pages):
+                pt_page.descriptor.lock.release_read()
 
         self.locked_pages.clear()
+        self._leaf = None
         self._released = True
 
     def __enter__(self):
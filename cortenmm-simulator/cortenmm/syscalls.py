@@ -10,10 +10,22 @@ CortenMM System Call Implementation
 4. munmap
 """
 
+import logging
+from array import array
 from typing import Optional
-from .core import Status, PTE, PTEMetadata
+from .core import (
+    Status, PTE, PTE_PFN_SHIFT, PTEMetadata, PAGE_SIZE, PAGE_MASK,
+    HUGE_PAGE_SIZE, PTES_PER_PAGE
+)
 from .addrspace import AddrSpace
 
+# 热路径日志：默认关闭 DEBUG 时，缺页/COW 路径不做任何格式化，
+# 也不会在 stdout 锁上串行化并发线程
+log = logging.getLogger(__name__)
+
+# COW 引用计数数组的初始容量（按 pfn 索引，覆盖分配器起点后的一段）
+_INITIAL_PFNS = 0x4000
+
 
 # ============================================================================
 # CortenMM 系统调用实现
@@ -27,9 +39,27 @@ class CortenMMSystem:
     def __init__(self):
         self.addr_space = AddrSpace()
 
-        # COW 页面的引用计数（pfn -> refcount）
+        # COW 页面的引用计数，按 pfn 直接索引的紧凑数组
+        # （pfn 由 allocate_pfn 顺序分配，密集数组比 dict 查找
+        # 便宜得多；默认值 1 表示"只有一个引用"）
         # 在真实系统中，这应该在 struct page 中
-        self.cow_refcounts = {}
+        self.cow_refcounts = array('H', (1,)) * _INITIAL_PFNS
+
+        # Overlay-on-Write：以 overlay=True fork 的共享页框集合，
+        # 及每个页框的脏缓存行位图（64 行 × 64B = 4KB 页）。
+        # 写这些页时只为写到的缓存行建覆盖层，不复制整页
+        self._overlay_pfns: set = set()
+        self.overlay_lines: dict = {}
+
+    def _ensure_pfn(self, pfn: int) -> array:
+        """确保引用计数数组覆盖 pfn（容量按 2 倍扩展，新段填 1）"""
+        refcounts = self.cow_refcounts
+        size = len(refcounts)
+        if pfn >= size:
+            while size <= pfn:
+                size *= 2
+            refcounts.extend(array('H', (1,)) * (size - len(refcounts)))
+        return refcounts
 
     def do_syscall_mmap(self, vaddr: int, length: int, prot: int) -> int:
         """
@@ -53,10 +83,23 @@ class CortenMMSystem:
             成功返回 vaddr，失败返回 -1
         """
         # 对齐到页边界
-        vaddr = vaddr & ~0xFFF
-        vaddr_end = (vaddr + length + 0xFFF) & ~0xFFF
+        vaddr = vaddr & PAGE_MASK
+        vaddr_end = (vaddr + length + PAGE_SIZE - 1) & PAGE_MASK
 
         try:
+            # 2MB 对齐的大范围优先走大页：每个窗口只在 PMD 项上
+            # 标记一次，不再创建叶子页表
+            size = vaddr_end - vaddr
+            if (vaddr % HUGE_PAGE_SIZE == 0 and size >= HUGE_PAGE_SIZE
+                    and size % HUGE_PAGE_SIZE == 0):
+                for chunk in range(vaddr, vaddr_end, HUGE_PAGE_SIZE):
+                    if not self.addr_space.mark_huge(chunk, soft_perm=prot):
+                        # 该窗口已有 4KB 叶子页表，回退小页路径
+                        with self.addr_space.lock(
+                                chunk, chunk + HUGE_PAGE_SIZE) as cursor:
+                            cursor.mark(Status.PrivateAnon, soft_perm=prot)
+                return vaddr
+
             # 使用 RCursor 锁定范围
             with self.addr_space.lock(vaddr, vaddr_end) as cursor:
                 # 批量标记为 PrivateAnon（延迟分配）
@@ -64,7 +107,7 @@ class CortenMMSystem:
 
             return vaddr
         except Exception as e:
-            print(f"mmap failed: {e}")
+            log.error("mmap failed: %s", e)
             return -1
 
     def do_syscall_munmap(self, vaddr: int, length: int) -> int:
@@ -78,10 +121,19 @@ class CortenMMSystem:
         Returns:
             成功返回 0，失败返回 -1
         """
-        vaddr = vaddr & ~0xFFF
-        vaddr_end = (vaddr + length + 0xFFF) & ~0xFFF
+        vaddr = vaddr & PAGE_MASK
+        vaddr_end = (vaddr + length + PAGE_SIZE - 1) & PAGE_MASK
 
         try:
+            # 先按 2MB 窗口清除大页映射；整个范围都是大页时直接返回
+            size = vaddr_end - vaddr
+            if (vaddr % HUGE_PAGE_SIZE == 0 and size >= HUGE_PAGE_SIZE
+                    and size % HUGE_PAGE_SIZE == 0):
+                cleared = [self.addr_space.clear_huge(chunk)
+                           for chunk in range(vaddr, vaddr_end, HUGE_PAGE_SIZE)]
+                if all(cleared):
+                    return 0
+
             # 锁定范围（可能需要 deep=True 来处理大范围）
             with self.addr_space.lock(vaddr, vaddr_end) as cursor:
                 # 批量解除映射
@@ -89,7 +141,7 @@ class CortenMMSystem:
 
             return 0
         except Exception as e:
-            print(f"munmap failed: {e}")
+            log.error("munmap failed: %s", e)
             return -1
 
     def handle_page_fault(self, vaddr: int, is_write: bool) -> bool:
@@ -116,75 +168,189 @@ class CortenMMSystem:
         Returns:
             True if handled, False if should SIGSEGV
         """
-        vaddr_page = vaddr & ~0xFFF
+        vaddr_page = vaddr & PAGE_MASK
+
+        # 大页快速路径：PMD 项上的映射不经过叶子页表
+        found = self.addr_space.find_huge(vaddr)
+        if found is not None:
+            return self._handle_huge_fault(found, vaddr, is_write)
 
         try:
-            # 锁定包含该地址的页表页
-            with self.addr_space.lock(vaddr_page, vaddr_page + 0x1000) as cursor:
-                # 查询状态
+            # 锁定包含该地址的页表页：走 lock_page 快路径，
+            # 省去 with lock(...) 每次进出 contextlib 生成器的开销
+            cursor = self.addr_space.lock_page(vaddr_page,
+                                               vaddr_page + PAGE_SIZE)
+            try:
+                # 查询状态，按 (状态, 是否写) 一次查表分发，
+                # 不再走 if/elif 级联逐个比较枚举
                 status = cursor.query(vaddr)
+                handler = self._FAULT_HANDLERS.get((status, is_write),
+                                                  CortenMMSystem._fault_invalid)
+                return handler(self, cursor, vaddr)
+            finally:
+                cursor.release()
+                self.addr_space.rcu_reclaimer.try_reclaim()
+
+        except Exception as e:
+            log.error("Page fault handler error: %s", e)
+            return False
+
+    def batch_handle_page_fault(self, vaddrs, is_write: bool = True) -> int:
+        """
+        批量处理一组缺页异常（单次加锁）
+
+        与逐个调用 handle_page_fault 语义等价，但整组地址只获取
+        一次范围锁，省去每页一次的加锁/放锁往返。要求地址组落在
+        同一个 2MB 叶子窗口内（示例与基准的典型访问模式）；
+        跨窗口或落在大页上时退回逐页路径。
+
+        Args:
+            vaddrs: 虚拟地址序列
+            is_write: 是否是写操作
+
+        Returns:
+            成功处理的缺页数
+        """
+        if not vaddrs:
+            return 0
 
-                # === 情况 1: PrivateAnon - 延迟分配 ===
-                if status == Status.PrivateAnon:
-                    # 分配物理页
-                    pfn = self.addr_space.allocate_pfn()
-
-                    # 建立映射（可写）
-                    cursor.map(vaddr, pfn, writable=True)
-
-                    print(f"Page fault: allocated pfn={hex(pfn)} for vaddr={hex(vaddr)}")
-                    return True
-
-                # === 情况 2: COW - 写时复制 ===
-                elif status == Status.COW:
-                    if not is_write:
-                        # 读操作，不需要复制
-                        # 但需要确保有映射
-                        result = cursor.get_pte_and_metadata(vaddr)
-                        if result is None:
-                            return False
-
-                        pte, metadata = result
-                        if not pte.is_valid():
-                            # 建立只读映射（共享物理页）
-                            # 这里简化处理，实际应该从 metadata 获取 pfn
-                            return False
-
-                        return True
-                    else:
-                        # 写操作，需要复制
-                        return self._handle_cow_write(cursor, vaddr)
-
-                # === 情况 3: Mapped - 权限检查 ===
-                elif status == Status.Mapped:
-                    result = cursor.get_pte_and_metadata(vaddr)
-                    if result is None:
-                        return False
-
-                    pte, metadata = result
-
-                    if is_write and not pte.rw:
-                        # 写操作但页面只读
-                        # 检查软件权限
-                        if metadata.soft_perm & 0b010:
-                            # 软件层面可写，可能是 COW
-                            # （这里简化处理）
-                            return False
-                        else:
-                            # 真的只读，SIGSEGV
-                            return False
-
-                    return True
-
-                # === 情况 4: Invalid - SIGSEGV ===
-                else:
-                    print(f"Page fault: invalid access to {hex(vaddr)}")
-                    return False
+        lo = min(vaddrs) & PAGE_MASK
+        hi = (max(vaddrs) & PAGE_MASK) + PAGE_SIZE
+        if (lo >> 21) != ((hi - 1) >> 21) or \
+                self.addr_space.find_huge(lo) is not None:
+            return sum(1 for v in vaddrs if self.handle_page_fault(v, is_write))
 
+        handled = 0
+        handlers = self._FAULT_HANDLERS
+        fallback = CortenMMSystem._fault_invalid
+        try:
+            with self.addr_space.lock(lo, hi) as cursor:
+                for vaddr in vaddrs:
+                    handler = handlers.get((cursor.query(vaddr), is_write),
+                                           fallback)
+                    if handler(self, cursor, vaddr):
+                        handled += 1
         except Exception as e:
-            print(f"Page fault handler error: {e}")
+            log.error("Batch page fault handler error: %s", e)
+        return handled
+
+    def _handle_huge_fault(self, found, vaddr: int, is_write: bool) -> bool:
+        """
+        处理落在 2MB 大页上的缺页异常
+
+        延迟分配：首次缺页时一次预留 512 个连续页框并置位
+        present，整个窗口之后的访问不再缺页
+
+        Args:
+            found: find_huge 返回的 (PMD 页表页, 项索引)
+            vaddr: 发生异常的虚拟地址
+            is_write: 是否是写操作
+        """
+        pmd_page, index = found
+        descriptor = pmd_page.descriptor
+
+        descriptor.lock.acquire_write()
+        try:
+            pte = pmd_page.get_pte(index)
+            if not pte.huge:
+                # 并发解除了大页映射
+                return False
+
+            if pte.present:
+                # 已映射：只需检查写权限
+                return (not is_write) or pte.rw
+
+            # 首次缺页：分配一个完整的 2MB 页框块
+            pfn = self.addr_space.allocate_pfn_range(PTES_PER_PAGE)
+
+            descriptor.write_begin()
+            pte.pfn = pfn
+            pte.present = True
+            pte.rw = True
+            metadata = descriptor.metadata(index)
+            metadata.status = Status.Mapped
+            descriptor.write_end()
+
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Huge page fault: allocated pfn block %#x for vaddr=%#x",
+                          pfn, vaddr)
+            return True
+        finally:
+            descriptor.lock.release_write()
+
+    # --- 各 (状态, 是否写) 组合的处理函数 ---
+
+    def _fault_alloc(self, cursor, vaddr: int) -> bool:
+        """PrivateAnon：延迟分配，缺页时才真正分配物理页"""
+        pfn = self.addr_space.allocate_pfn()
+
+        # 建立映射（可写）
+        cursor.map(vaddr, pfn, writable=True)
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Page fault: allocated pfn=%#x for vaddr=%#x", pfn, vaddr)
+        return True
+
+    def _fault_cow_read(self, cursor, vaddr: int) -> bool:
+        """COW + 读：不需要复制，只确认映射存在"""
+        result = cursor.get_pte_and_metadata(vaddr)
+        if result is None:
+            return False
+
+        pte, metadata = result
+        if not pte.is_valid():
+            # 建立只读映射（共享物理页）
+            # 这里简化处理，实际应该从 metadata 获取 pfn
             return False
 
+        return True
+
+    def _fault_cow_write(self, cursor, vaddr: int) -> bool:
+        """COW + 写：执行写时复制"""
+        return self._handle_cow_write(cursor, vaddr)
+
+    def _fault_mapped_read(self, cursor, vaddr: int) -> bool:
+        """Mapped + 读：最常见的快速路径，直接成功"""
+        return True
+
+    def _fault_mapped_write(self, cursor, vaddr: int) -> bool:
+        """Mapped + 写：检查硬件写权限"""
+        result = cursor.get_pte_and_metadata(vaddr)
+        if result is None:
+            return False
+
+        pte, metadata = result
+
+        if not pte.rw:
+            # 写操作但页面只读
+            # 检查软件权限
+            if metadata.soft_perm & 0b010:
+                # 软件层面可写，可能是 COW
+                # （这里简化处理）
+                return False
+            else:
+                # 真的只读，SIGSEGV
+                return False
+
+        return True
+
+    def _fault_invalid(self, cursor, vaddr: int) -> bool:
+        """Invalid（或未覆盖的组合）：SIGSEGV"""
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Page fault: invalid access to %#x", vaddr)
+        return False
+
+    # 分发表：(status, is_write) -> 处理函数
+    # PrivateAnon 的读/写都走延迟分配
+    _FAULT_HANDLERS = {
+        (Status.PrivateAnon, False): _fault_alloc,
+        (Status.PrivateAnon, True): _fault_alloc,
+        (Status.COW, False): _fault_cow_read,
+        (Status.COW, True): _fault_cow_write,
+        (Status.Mapped, False): _fault_mapped_read,
+        (Status.Mapped, True): _fault_mapped_write,
+    }
+
     def _handle_cow_write(self, cursor, vaddr: int) -> bool:
         """
         处理 COW 写操作
@@ -214,23 +380,39 @@ class CortenMMSystem:
         old_pfn = pte.pfn
 
         # 获取引用计数
-        refcount = self.cow_refcounts.get(old_pfn, 1)
+        refcount = self._ensure_pfn(old_pfn)[old_pfn]
 
         if refcount > 1:
+            if old_pfn in self._overlay_pfns:
+                # === Overlay-on-Write ===
+                # 只为写到的 64B 缓存行建立覆盖层：共享页框原样保留
+                # （父进程的热页不被逐出缓存），页保持 COW 只读，
+                # 之后写其它缓存行继续按行捕获
+                line = (vaddr >> 6) & 0x3F
+                self.overlay_lines[old_pfn] = \
+                    self.overlay_lines.get(old_pfn, 0) | (1 << line)
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("OOW: overlaid line %d of pfn %#x for vaddr %#x",
+                              line, old_pfn, vaddr)
+                return True
+
             # === Copy-on-Write ===
             # 分配新的物理页
             new_pfn = self.addr_space.allocate_pfn()
 
             # 复制数据（在真实系统中需要实际复制内存）
             # 这里只是模拟
-            print(f"COW: copied pfn {hex(old_pfn)} -> {hex(new_pfn)} for vaddr {hex(vaddr)}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("COW: copied pfn %#x -> %#x for vaddr %#x",
+                          old_pfn, new_pfn, vaddr)
 
             # 更新映射
             cursor.map(vaddr, new_pfn, writable=True)
 
             # 更新引用计数
-            self.cow_refcounts[old_pfn] = refcount - 1
-            self.cow_refcounts[new_pfn] = 1
+            refcounts = self._ensure_pfn(new_pfn)
+            refcounts[old_pfn] = refcount - 1
+            refcounts[new_pfn] = 1
 
             # 更新状态为 PrivateAnon
             metadata.status = Status.PrivateAnon
@@ -242,11 +424,12 @@ class CortenMMSystem:
             metadata.status = Status.PrivateAnon
             metadata.refcount = 1
 
-            print(f"COW: last reference, made writable: vaddr={hex(vaddr)}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("COW: last reference, made writable: vaddr=%#x", vaddr)
 
         return True
 
-    def do_fork_cow(self, vaddr: int, length: int) -> bool:
+    def do_fork_cow(self, vaddr: int, length: int, overlay: bool = False) -> bool:
         """
         fork 时的 COW 设置
 
@@ -255,41 +438,45 @@ class CortenMMSystem:
         Args:
             vaddr: 起始地址
             length: 长度
+            overlay: 写时只覆盖被写到的缓存行（Overlay-on-Write），
+                     不复制整个 4KB 页框
 
         Returns:
             是否成功
         """
-        vaddr = vaddr & ~0xFFF
-        vaddr_end = (vaddr + length + 0xFFF) & ~0xFFF
+        vaddr = vaddr & PAGE_MASK
+        vaddr_end = (vaddr + length + PAGE_SIZE - 1) & PAGE_MASK
+
+        # fork 快速路径：范围内没有叶子页表时整段必然未映射，
+        # 直接成功返回——不取锁，更不触发叶子页表的按需创建
+        # （lock 会为不存在的叶子调用 _create_leaf_page）
+        if self.addr_space.find_leaf(vaddr) is None:
+            return True
 
         try:
             with self.addr_space.lock(vaddr, vaddr_end) as cursor:
-                # 遍历范围内的所有页面
-                current_vaddr = vaddr
-                while current_vaddr < vaddr_end:
-                    result = cursor.get_pte_and_metadata(current_vaddr)
-                    if result is not None:
-                        pte, metadata = result
-
-                        if pte.is_valid() and metadata.status == Status.Mapped:
-                            # 标记为 COW
-                            metadata.status = Status.COW
-
-                            # 设置硬件只读（触发写时异常）
-                            pte.rw = False
-
-                            # 增加引用计数
-                            pfn = pte.pfn
-                            self.cow_refcounts[pfn] = self.cow_refcounts.get(pfn, 1) + 1
-                            metadata.refcount = self.cow_refcounts[pfn]
-
-                    current_vaddr += 0x1000
+                # 批量转换：叶子页表整段扫描并改写（状态 COW + 硬件只读），
+                # 这里只剩对受影响页面的引用计数更新
+                for pt_page, indices in cursor.cow_protect_range():
+                    descriptor = pt_page.descriptor
+                    words = pt_page.pte_words
+                    for i in indices:
+                        pfn = words[i] >> PTE_PFN_SHIFT
+                        refcounts = self._ensure_pfn(pfn)
+                        refcounts[pfn] += 1
+                        descriptor.refcounts[i] = refcounts[pfn]
+                        if overlay:
+                            self._overlay_pfns.add(pfn)
 
             return True
         except Exception as e:
-            print(f"fork COW setup failed: {e}")
+            log.error("fork COW setup failed: %s", e)
             return False
 
+    def overlay_line_count(self, pfn: int) -> int:
+        """某个共享页框上已建立覆盖层的缓存行数"""
+        return self.overlay_lines.get(pfn, 0).bit_count()
+
 
 # ============================================================================
 # 模块导出